@@ -0,0 +1,302 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import itertools
+from pathlib import Path
+import numpy as np
+import cv2
+import mediapipe as mp
+from mediapipe.framework.formats import landmark_pb2
+from frame_source import create_frame_source
+from capture_engine import FrameGrabber, RoiTracker
+from landmark_store import face_mesh_landmark_count
+from landmark_formats import LANDMARK_FORMATS, LandmarkSchema
+
+STAGES = ("capture", "convert", "inference", "row_build", "write")
+
+def get_peak_rss_mb():
+    """Return the peak resident set size of this process in MB, if available."""
+    try:
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # Reported in bytes on macOS and in kilobytes elsewhere
+        return peak / 1e6 if sys.platform == "darwin" else peak / 1e3
+    except ImportError:
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 1e6
+    except (ImportError, AttributeError):
+        return None
+
+def placeholder_landmarks(num_landmarks):
+    """Build a landmark list used for the row and write stages when no face is found."""
+    landmarks = landmark_pb2.NormalizedLandmarkList()
+    for i in range(num_landmarks):
+        point = landmarks.landmark.add()
+        point.x, point.y, point.z = (i % 100) / 100, (i // 100) / 5, 0.0
+    return landmarks
+
+class StageTimer:
+    """Collects wall-clock latency and CPU time per pipeline stage."""
+
+    def __init__(self, grabber=None):
+        """
+        Initialize the timer.
+
+        Args:
+            grabber: FrameGrabber running next to the measured stages; its CPU
+                     time is reported as a separate "grab" entry
+        """
+        self.latencies = {stage: [] for stage in STAGES}
+        self.cpu_seconds = {stage: 0.0 for stage in STAGES}
+        self.grabber = grabber
+        self.grab_cpu_start = grabber.cpu_seconds if grabber is not None else 0.0
+        self.grab_frames_start = grabber.frames_grabbed if grabber is not None else 0
+
+    def measure(self, stage, function, *args):
+        """Run function(*args) and record its duration under the given stage."""
+        # Process CPU time includes MediaPipe's own graph threads, which
+        # time.thread_time() would miss; only the grab thread is taken out
+        grab_cpu_start = self.grabber.cpu_seconds if self.grabber is not None else 0.0
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        result = function(*args)
+        cpu = time.process_time() - cpu_start
+        if self.grabber is not None:
+            cpu -= self.grabber.cpu_seconds - grab_cpu_start
+        self.cpu_seconds[stage] += max(cpu, 0.0)
+        self.latencies[stage].append(time.perf_counter() - wall_start)
+        return result
+
+    def summary(self):
+        """Return count, mean and p50/p95/p99 latency in ms and CPU seconds per stage."""
+        summary = {}
+        for stage in STAGES:
+            values = np.array(self.latencies[stage]) * 1000
+            if len(values) == 0:
+                summary[stage] = {"count": 0}
+                continue
+            summary[stage] = {
+                "count": int(len(values)),
+                "mean_ms": float(values.mean()),
+                "p50_ms": float(np.percentile(values, 50)),
+                "p95_ms": float(np.percentile(values, 95)),
+                "p99_ms": float(np.percentile(values, 99)),
+                "cpu_s": self.cpu_seconds[stage]
+            }
+        if self.grabber is not None:
+            summary["grab"] = {
+                "count": self.grabber.frames_grabbed - self.grab_frames_start,
+                "cpu_s": self.grabber.cpu_seconds - self.grab_cpu_start
+            }
+        return summary
+
+def run_benchmark(source_spec, num_frames=300, resolution=None, refine_landmarks=True,
+                  output_format="csv", pipelined=False, batch_size=100, warmup_frames=10,
+                  roi_tracking=False):
+    """
+    Drive capture -> convert -> FaceMesh -> row build -> write on a frame source.
+
+    Args:
+        source_spec: Frame source specification (see create_frame_source)
+        num_frames: Number of measured frames
+        resolution: Optional (width, height) every frame is resized to after capture
+        refine_landmarks: FaceMesh iris refinement (478 instead of 468 landmarks)
+        output_format: Landmark output format written in the write stage
+        pipelined: Capture on a grab thread that keeps only the newest frame, as
+                   the application does; otherwise every frame is processed in turn
+        batch_size: Frames per write batch
+        warmup_frames: Frames processed before measuring starts
+        roi_tracking: Run FaceMesh on a crop around the previous frame's face
+
+    Returns:
+        dict: Benchmark results
+    """
+    source = create_frame_source(source_spec)
+    if not source.open():
+        raise IOError(f"Cannot open {source.describe()}")
+
+    face_mesh = mp.solutions.face_mesh.FaceMesh(
+        max_num_faces=1,
+        refine_landmarks=refine_landmarks,
+        min_detection_confidence=0.5,
+        min_tracking_confidence=0.5
+    )
+    schema = LandmarkSchema.get(face_mesh_landmark_count(refine_landmarks))
+    placeholder = placeholder_landmarks(schema.num_landmarks)
+    output_dir = Path(tempfile.mkdtemp(prefix="gaze_benchmark_"))
+    output_class = LANDMARK_FORMATS[output_format]
+    output = output_class(output_dir / output_class.filename, schema, {"benchmark": True})
+
+    store = schema.create_store(chunk_size=batch_size)
+    # A finite source (a clip without loop=1) ends the run instead of being retried
+    grabber = FrameGrabber(source, max_failed_reads=20) if pipelined else None
+    timer = StageTimer(grabber)
+    roi_tracker = RoiTracker() if roi_tracking else None
+    faces_detected = 0
+    frames_processed = 0
+
+    def capture():
+        if grabber is not None:
+            latest = None
+            while latest is None:
+                # Read the flag first: a frame stored before the end is still returned
+                ended = grabber.end_of_stream
+                latest = grabber.get_latest()
+                if latest is None and ended:
+                    return False, None
+            return True, latest[3]
+        return source.read()
+
+    def infer(frame_rgb, roi, frame_shape):
+        # Remapping the crop's landmarks is part of the inference cost
+        results = face_mesh.process(frame_rgb)
+        if roi_tracker is not None:
+            landmarks = results.multi_face_landmarks[0] if results.multi_face_landmarks else None
+            roi_tracker.update(landmarks, roi, frame_shape)
+        return results
+
+    try:
+        if grabber is not None:
+            grabber.start()
+
+        start = None
+        dropped_at_start = 0
+        for index in range(warmup_frames + num_frames):
+            if index == warmup_frames:
+                timer = StageTimer(grabber)
+                store.clear()
+                faces_detected = 0
+                start = time.perf_counter()
+                cpu_start = time.process_time()
+                dropped_at_start = grabber.frames_dropped if grabber else 0
+
+            ret, frame = timer.measure("capture", capture)
+            if not ret:
+                break
+            if resolution is not None and (frame.shape[1], frame.shape[0]) != resolution:
+                frame = cv2.resize(frame, resolution)
+
+            image, roi = roi_tracker.crop(frame) if roi_tracker is not None else (frame, None)
+            frame_rgb = timer.measure("convert", cv2.cvtColor, image, cv2.COLOR_BGR2RGB)
+            results = timer.measure("inference", infer, frame_rgb, roi, frame.shape)
+
+            landmarks = placeholder
+            if results.multi_face_landmarks:
+                landmarks = results.multi_face_landmarks[0]
+                faces_detected += 1
+            timer.measure("row_build", store.append, time.time(), 0.0, 0.0, landmarks)
+
+            if len(store) >= batch_size:
+                timer.measure("write", output.write_batch, store)
+                store.clear()
+            if index >= warmup_frames:
+                frames_processed += 1
+
+        if len(store):
+            timer.measure("write", output.write_batch, store)
+        timer.measure("write", output.close)
+        elapsed = time.perf_counter() - start if start is not None else 0.0
+        total_cpu = time.process_time() - cpu_start if start is not None else 0.0
+        frames_dropped = grabber.frames_dropped - dropped_at_start if grabber is not None else 0
+    finally:
+        if grabber is not None:
+            grabber.stop()
+        source.release()
+        face_mesh.close()
+
+    output_bytes = sum(f.stat().st_size for f in output_dir.iterdir())
+    shutil.rmtree(output_dir, ignore_errors=True)
+
+    # Nothing was measured if the source ran out during warm-up
+    error = None
+    if start is None:
+        error = f"source ended during the {warmup_frames} warm-up frames"
+        timer = StageTimer()
+        frames_dropped = 0
+
+    return {
+        "config": {
+            "source": source.describe(),
+            "resolution": list(resolution) if resolution else None,
+            "refine_landmarks": refine_landmarks,
+            "output_format": output_format,
+            "pipelined": pipelined,
+            "batch_size": batch_size,
+            "roi_tracking": roi_tracking
+        },
+        "frames": frames_processed,
+        "faces_detected": faces_detected,
+        "fps": frames_processed / elapsed if elapsed else 0.0,
+        "frames_dropped": frames_dropped,
+        "cpu_s": total_cpu,
+        "stages": timer.summary(),
+        "output_bytes_per_frame": output_bytes / frames_processed if frames_processed else 0.0,
+        "peak_rss_mb": get_peak_rss_mb(),
+        "error": error
+    }
+
+def parse_resolution(value):
+    """Parse a WIDTHxHEIGHT argument."""
+    width, height = value.lower().split("x")
+    return int(width), int(height)
+
+def main():
+    """Run the benchmark for every combination of the requested settings."""
+    parser = argparse.ArgumentParser(description="Benchmark the landmark capture pipeline.")
+    parser.add_argument("--source", default="synthetic:fps=0",
+                        help="Frame source, e.g. 'video:reference.avi,fps=0' (default: unthrottled synthetic)")
+    parser.add_argument("--frames", type=int, default=300, help="Measured frames per configuration")
+    parser.add_argument("--resolutions", nargs="+", type=parse_resolution, default=[None],
+                        help="Resize captured frames, e.g. 640x480 1280x720")
+    parser.add_argument("--refine", choices=["on", "off", "both"], default="on",
+                        help="FaceMesh iris refinement")
+    parser.add_argument("--formats", nargs="+", default=["csv"], choices=sorted(LANDMARK_FORMATS),
+                        help="Output formats to compare")
+    parser.add_argument("--pipelined", action="store_true",
+                        help="Use the application's drop-oldest grab thread")
+    parser.add_argument("--roi", action="store_true",
+                        help="Run FaceMesh on a crop around the previously found face")
+    parser.add_argument("--json", help="Write the results as JSON to this file ('-' for stdout)")
+    args = parser.parse_args()
+
+    refine_options = {"on": [True], "off": [False], "both": [True, False]}[args.refine]
+    results = []
+    for resolution, refine, output_format in itertools.product(args.resolutions, refine_options, args.formats):
+        result = run_benchmark(args.source, args.frames, resolution, refine, output_format, args.pipelined,
+                               roi_tracking=args.roi)
+        results.append(result)
+
+        config = result["config"]
+        size = "x".join(map(str, config["resolution"])) if config["resolution"] else "native"
+        if result["error"]:
+            print(f"{config['source']} | {size} | refine={config['refine_landmarks']} | "
+                  f"{config['output_format']}: no measurement, {result['error']}", file=sys.stderr)
+            continue
+        print(f"{config['source']} | {size} | refine={config['refine_landmarks']} | "
+              f"{config['output_format']}{' | roi' if config['roi_tracking'] else ''}: {result['fps']:.1f} fps, {result['frames_dropped']} dropped, "
+              f"{result['faces_detected']}/{result['frames']} faces, "
+              f"peak RSS {result['peak_rss_mb'] or 0:.0f} MB", file=sys.stderr)
+        for stage, stats in result["stages"].items():
+            if stage == "grab":
+                print(f"    {'grab':10s} {stats['count']} frames on the grab thread, "
+                      f"cpu {stats['cpu_s']:.2f} s", file=sys.stderr)
+            elif stats["count"]:
+                print(f"    {stage:10s} p50 {stats['p50_ms']:7.2f} ms  p95 {stats['p95_ms']:7.2f} ms  "
+                      f"p99 {stats['p99_ms']:7.2f} ms  cpu {stats['cpu_s']:.2f} s", file=sys.stderr)
+
+    report = {"generated": time.strftime("%Y-%m-%d %H:%M:%S"), "cpu_count": os.cpu_count(), "results": results}
+    if args.json == "-":
+        json.dump(report, sys.stdout, indent=2)
+    elif args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report, f, indent=2)
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,577 @@
+import csv
+import queue
+import threading
+import time
+import logging
+from pathlib import Path
+from PyQt5.QtCore import QThread, pyqtSignal
+import cv2
+import numpy as np
+from frame_source import create_frame_source, clock, clock_to_unix
+from landmark_store import REFINE_LANDMARKS
+
+# Capture states: idle runs no inference; preview (the setup window), warmup
+# and recording process every frame and are only told apart in the usage
+# report; rest processes frames at a reduced rate to keep FaceMesh tracking warm
+CAPTURE_STATES = ("idle", "preview", "warmup", "recording", "rest")
+
+class VideoRecorder(threading.Thread):
+    """Writes raw camera frames and their capture timestamps for offline re-processing."""
+
+    def __init__(self, video_path, fps, max_queue_size=60):
+        """
+        Initialize the video recorder.
+
+        Args:
+            video_path: Path of the .avi file to write; frame capture times are
+                        written to <name>_frames.csv next to it
+            fps: Nominal frame rate stored in the video header
+            max_queue_size: Maximum number of frames waiting to be encoded
+        """
+        super().__init__(daemon=True)
+        self.video_path = Path(video_path)
+        self.frames_path = self.video_path.with_name(f"{self.video_path.stem}_frames.csv")
+        self.fps = fps
+        self.frames_written = 0
+        self.frames_dropped = 0
+        self._frames = queue.Queue(maxsize=max_queue_size)
+
+    def add_frame(self, frame_index, capture_time, frame):
+        """Queue a frame for encoding without blocking the caller."""
+        try:
+            self._frames.put_nowait((frame_index, capture_time, frame))
+        except queue.Full:
+            self.frames_dropped += 1
+
+    def run(self):
+        """Encode queued frames until a stop marker arrives."""
+        writer = None
+        with open(self.frames_path, 'w', newline='') as f:
+            timeline = csv.writer(f)
+            timeline.writerow(["video_frame", "frame_index", "timestamp", "capture_time"])
+            try:
+                while True:
+                    item = self._frames.get()
+                    if item is None:
+                        break
+                    frame_index, capture_time, frame = item
+
+                    if writer is None:
+                        height, width = frame.shape[:2]
+                        writer = cv2.VideoWriter(str(self.video_path),
+                                                 cv2.VideoWriter_fourcc(*'MJPG'),
+                                                 self.fps, (width, height))
+                    writer.write(frame)
+                    timeline.writerow([self.frames_written, frame_index,
+                                       repr(clock_to_unix(capture_time)), repr(capture_time)])
+                    self.frames_written += 1
+            finally:
+                if writer is not None:
+                    writer.release()
+        logging.info(f"Recorded {self.frames_written} frames to {self.video_path} "
+                     f"({self.frames_dropped} dropped)")
+
+    def stop(self):
+        """Encode the remaining frames and close the files."""
+        self._frames.put(None)
+        self.join()
+
+class FrameGrabber(threading.Thread):
+    """Producer thread that reads the camera continuously and keeps only the newest frame."""
+
+    def __init__(self, camera, recorder=None, max_failed_reads=None):
+        """
+        Initialize the frame grabber.
+
+        Args:
+            camera: Opened FrameSource to read from
+            recorder: Optional VideoRecorder receiving every grabbed frame
+            max_failed_reads: Consecutive failed reads after which the source is
+                              treated as ended (None retries forever, as a live
+                              camera may stall briefly)
+        """
+        super().__init__(daemon=True)
+        self.camera = camera
+        self.recorder = recorder
+        self.max_failed_reads = max_failed_reads
+        self.end_of_stream = False
+        self.frames_grabbed = 0
+        self.frames_dropped = 0
+        # CPU seconds used by this thread, updated after every read
+        self.cpu_seconds = 0.0
+        self._latest = None
+        self._condition = threading.Condition()
+        self._stop_requested = False
+
+    def run(self):
+        """Read frames until stopped or the source ends, replacing any frame not yet consumed."""
+        failed_reads = 0
+        while not self._stop_requested:
+            ret, frame = self.camera.read()
+            self.cpu_seconds = time.thread_time()
+            if not ret:
+                failed_reads += 1
+                if self.max_failed_reads is not None and failed_reads >= self.max_failed_reads:
+                    with self._condition:
+                        self.end_of_stream = True
+                        self._condition.notify()
+                    return
+                time.sleep(0.005)
+                continue
+            failed_reads = 0
+
+            # Stamp the frame as soon as it has been grabbed
+            capture_time = clock()
+            camera_time = self.camera.get_timestamp()
+
+            with self._condition:
+                if self._latest is not None:
+                    self.frames_dropped += 1
+                self.frames_grabbed += 1
+                frame_index = self.frames_grabbed
+                self._latest = (frame_index, capture_time, camera_time, frame)
+                self._condition.notify()
+
+            # The recorder can be swapped by the engine while grabbing
+            recorder = self.recorder
+            if recorder is not None:
+                recorder.add_frame(frame_index, capture_time, frame)
+
+    def get_latest(self, timeout=0.1):
+        """
+        Take the newest frame that has not been consumed yet.
+
+        Args:
+            timeout: Seconds to wait for a new frame
+
+        Returns:
+            tuple: (frame_index, capture_time, camera_time, frame) or None if no
+                   new frame arrived; capture_time is a clock() reading. Once
+                   end_of_stream is set, None means no frame will follow
+        """
+        with self._condition:
+            if self._latest is None and not self.end_of_stream:
+                self._condition.wait(timeout)
+            latest = self._latest
+            self._latest = None
+            return latest
+
+    def stop(self):
+        """Stop reading and wait for the thread to exit."""
+        self._stop_requested = True
+        self.join()
+
+class RoiTracker:
+    """
+    Crops frames around the face found in the previous frame so FaceMesh sees fewer pixels.
+
+    The crop is kept in place while the face stays well inside it, because
+    FaceMesh tracks the face in crop coordinates between frames; it is only
+    moved when the face nears its border or shrinks, and dropped for a
+    full-frame re-detection when the face is lost.
+    """
+
+    def __init__(self, margin=0.5, min_size=192):
+        """
+        Initialize the tracker.
+
+        Args:
+            margin: Space added on every side of the face box, relative to its size
+            min_size: Minimum crop side in pixels
+        """
+        self.margin = margin
+        self.min_size = min_size
+        self.roi = None
+        self.frames_cropped = 0
+        self.redetections = 0
+
+    def reset(self):
+        """Go back to full-frame detection, e.g. after the frame orientation changed."""
+        self.roi = None
+
+    def crop(self, frame):
+        """
+        Cut the tracked region out of a frame.
+
+        Returns:
+            tuple: (image, roi) where roi is the (x0, y0, x1, y1) pixel box of
+                   the image, or None if the full frame is used
+        """
+        roi = self.roi
+        if roi is None:
+            return frame, None
+        x0, y0, x1, y1 = roi
+        self.frames_cropped += 1
+        return frame[y0:y1, x0:x1], roi
+
+    def update(self, landmarks, roi, frame_shape):
+        """
+        Map landmarks found in a crop to full-frame coordinates and move the crop.
+
+        Args:
+            landmarks: NormalizedLandmarkList from FaceMesh, modified in place,
+                       or None if no face was found
+            roi: Crop returned by crop() for this frame
+            frame_shape: Shape of the full frame
+        """
+        if landmarks is None:
+            if roi is not None:
+                self.redetections += 1
+            self.roi = None
+            return
+
+        height, width = frame_shape[:2]
+        x0, y0 = (roi[0], roi[1]) if roi is not None else (0, 0)
+        crop_w = roi[2] - roi[0] if roi is not None else width
+        crop_h = roi[3] - roi[1] if roi is not None else height
+
+        # x and y are normalized by the crop size, z by the crop width
+        face_x0 = face_y0 = float("inf")
+        face_x1 = face_y1 = float("-inf")
+        for point in landmarks.landmark:
+            px = point.x * crop_w + x0
+            py = point.y * crop_h + y0
+            if roi is not None:
+                point.x = px / width
+                point.y = py / height
+                point.z = point.z * crop_w / width
+            face_x0, face_x1 = min(face_x0, px), max(face_x1, px)
+            face_y0, face_y1 = min(face_y0, py), max(face_y1, py)
+
+        face_size = max(face_x1 - face_x0, face_y1 - face_y0)
+        side = max(int(face_size * (1 + 2 * self.margin)), self.min_size)
+        if roi is not None:
+            # Keep the crop while the face is inside it with slack and fills enough of it
+            slack = face_size * self.margin / 2
+            inside = (face_x0 - slack >= roi[0] or roi[0] == 0) and \
+                     (face_y0 - slack >= roi[1] or roi[1] == 0) and \
+                     (face_x1 + slack <= roi[2] or roi[2] == width) and \
+                     (face_y1 + slack <= roi[3] or roi[3] == height)
+            if inside and side * 1.5 >= max(crop_w, crop_h):
+                return
+
+        if side * side >= 0.8 * width * height:
+            self.roi = None
+            return
+        center_x, center_y = (face_x0 + face_x1) / 2, (face_y0 + face_y1) / 2
+        rx0 = int(min(max(center_x - side / 2, 0), max(width - side, 0)))
+        ry0 = int(min(max(center_y - side / 2, 0), max(height - side, 0)))
+        self.roi = (rx0, ry0, min(rx0 + side, width), min(ry0 + side, height))
+
+class FrameResult:
+    """Landmark result for a single camera frame."""
+
+    def __init__(self, frame_index, capture_time, landmarks, frame=None,
+                 camera_time=None, inference_start=None, inference_end=None):
+        """
+        Initialize the frame result.
+
+        Args:
+            frame_index: Sequence number assigned by the frame grabber
+            capture_time: Monotonic clock() reading taken when the frame was grabbed
+            landmarks: First detected face landmarks, or None if no face was found
+            frame: BGR frame the landmarks were computed on, if requested
+            camera_time: Capture backend's own frame timestamp, if it has one
+            inference_start: clock() reading before FaceMesh processing
+            inference_end: clock() reading after FaceMesh processing
+        """
+        self.frame_index = frame_index
+        self.capture_time = capture_time
+        self.timestamp = clock_to_unix(capture_time)
+        self.landmarks = landmarks
+        self.frame = frame
+        self.camera_time = camera_time
+        self.inference_start = inference_start
+        self.inference_end = inference_end
+
+    @property
+    def timing(self):
+        """Timing values in landmark_store.TIMING_FIELDS order."""
+        return (self.capture_time, self.camera_time, self.inference_start, self.inference_end)
+
+class CaptureEngine(QThread):
+    """Capture pipeline shared by all windows: a grab thread feeding a FaceMesh inference stage."""
+    camera_opened = pyqtSignal()
+    camera_failed = pyqtSignal(str)
+    results_ready = pyqtSignal()
+    state_changed = pyqtSignal(str)
+
+    def __init__(self, frame_source=None, flip=False, keep_frames=False,
+                 max_queue_size=30, video_path=None, state="recording", rest_fps=5,
+                 roi_tracking=False, parent=None):
+        """
+        Initialize the capture engine.
+
+        Args:
+            frame_source: FrameSource to capture from (default: see create_frame_source)
+            flip: Mirror frames horizontally before inference
+            keep_frames: Attach the processed frame to each result (for previews)
+            max_queue_size: Maximum number of unread results kept for the GUI thread
+            video_path: Optional path to record the raw camera frames to
+            state: Initial capture state (one of CAPTURE_STATES)
+            rest_fps: Inference rate in the rest state
+            roi_tracking: Run FaceMesh on a crop around the previous frame's face
+                          (see RoiTracker); landmarks stay full-frame normalized
+            parent: Parent QObject
+        """
+        super().__init__(parent)
+        self.frame_source = frame_source if frame_source is not None else create_frame_source()
+        self.video_path = video_path
+        self.flip = flip
+        self.keep_frames = keep_frames
+        self.results = queue.Queue(maxsize=max_queue_size)
+        self.camera_properties = {}
+        self.frames_processed = 0
+        self.results_dropped = 0
+        self.rest_fps = rest_fps
+        self.roi_tracker = RoiTracker() if roi_tracking else None
+        self.camera_open = False
+        self.warmup_seconds = None
+        self._grabber = None
+        self._video_lock = threading.Lock()
+        self._stop_requested = False
+
+        if state not in CAPTURE_STATES:
+            raise ValueError(f"Unknown capture state: {state}")
+        self._state = state
+        self._state_lock = threading.Lock()
+        self._state_usage = {
+            name: {"seconds": 0.0, "cpu_seconds": 0.0, "frames_processed": 0}
+            for name in CAPTURE_STATES
+        }
+        self._usage_wall = None
+        self._usage_cpu = None
+
+    def run(self):
+        """Start the grab thread and run FaceMesh on the newest frame until stopped."""
+        warmup_start = clock()
+        camera = self.frame_source
+        if not camera.open():
+            camera.release()
+            self.camera_failed.emit(f"Failed to open {camera.describe()}!")
+            return
+
+        self.camera_properties = camera.get_properties()
+
+        # MediaPipe is the slowest import of the application, so it is loaded
+        # on the capture thread rather than when this module is imported
+        import mediapipe as mp
+        face_mesh = mp.solutions.face_mesh.FaceMesh(
+            max_num_faces=1,
+            refine_landmarks=REFINE_LANDMARKS,
+            min_detection_confidence=0.5,
+            min_tracking_confidence=0.5
+        )
+        # The first process() call sets up the graph; pay for it with a blank
+        # frame instead of the first camera frame
+        width = self.camera_properties["width"] or 640
+        height = self.camera_properties["height"] or 480
+        face_mesh.process(np.zeros((height, width, 3), dtype=np.uint8))
+
+        self._grabber = FrameGrabber(camera)
+        with self._video_lock:
+            self.camera_open = True
+            if self.video_path is not None:
+                self._start_recorder()
+        self._grabber.start()
+        with self._state_lock:
+            self._usage_wall = clock()
+            self._usage_cpu = time.process_time()
+        self.warmup_seconds = clock() - warmup_start
+        logging.info(f"Capture engine ready after {self.warmup_seconds * 1000:.0f} ms "
+                     f"(camera open, FaceMesh init and first frame)")
+        self.camera_opened.emit()
+
+        next_rest_inference = 0.0
+        tracked_flip = self.flip
+        try:
+            while not self._stop_requested:
+                latest = self._grabber.get_latest()
+                with self._state_lock:
+                    self._account_usage()
+                    state = self._state
+                if latest is None:
+                    continue
+                frame_index, capture_time, camera_time, frame = latest
+
+                # Skip frames while idle and thin them out during rests
+                if state == "idle":
+                    continue
+                if state == "rest":
+                    if capture_time < next_rest_inference:
+                        continue
+                    next_rest_inference = capture_time + 1.0 / self.rest_fps
+
+                flip = self.flip
+                if flip:
+                    frame = cv2.flip(frame, 1)
+
+                # A crop found on mirrored frames does not apply to unmirrored ones
+                roi_tracker = self.roi_tracker
+                if roi_tracker is not None and flip != tracked_flip:
+                    roi_tracker.reset()
+                tracked_flip = flip
+
+                # Process frame with MediaPipe
+                inference_start = clock()
+                image, roi = roi_tracker.crop(frame) if roi_tracker is not None else (frame, None)
+                frame_rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+                results = face_mesh.process(frame_rgb)
+
+                landmarks = None
+                if results.multi_face_landmarks:
+                    landmarks = results.multi_face_landmarks[0]
+                if roi_tracker is not None:
+                    roi_tracker.update(landmarks, roi, frame.shape)
+                inference_end = clock()
+
+                self.frames_processed += 1
+                with self._state_lock:
+                    self._state_usage[state]["frames_processed"] += 1
+                self._publish(FrameResult(
+                    frame_index,
+                    capture_time,
+                    landmarks,
+                    frame if self.keep_frames else None,
+                    camera_time,
+                    inference_start,
+                    inference_end
+                ))
+        finally:
+            self._grabber.stop()
+            self.stop_video()
+            self.camera_open = False
+            camera.release()
+            face_mesh.close()
+            with self._state_lock:
+                self._account_usage()
+                self._usage_wall = None
+            logging.info(f"Capture engine stopped: {self.get_stats()}")
+            logging.info(f"Capture state usage: {self.get_state_usage()}")
+
+    def _start_recorder(self):
+        """Attach a new video recorder to the grab thread; needs the video lock."""
+        recorder = VideoRecorder(self.video_path, self.camera_properties["fps"] or 30)
+        recorder.start()
+        self._grabber.recorder = recorder
+
+    def start_video(self, video_path):
+        """
+        Record the raw camera frames from now on.
+
+        Args:
+            video_path: Path of the .avi file; recording starts when the camera
+                        opens if it is not open yet
+        """
+        self.stop_video()
+        with self._video_lock:
+            self.video_path = video_path
+            if self.camera_open:
+                self._start_recorder()
+
+    def stop_video(self):
+        """Stop recording and close the video files."""
+        with self._video_lock:
+            self.video_path = None
+            recorder = self._grabber.recorder if self._grabber is not None else None
+            if recorder is not None:
+                self._grabber.recorder = None
+        if recorder is not None:
+            recorder.stop()
+
+    def _account_usage(self):
+        """Charge the time and process CPU since the last call to the current state."""
+        if self._usage_wall is None:
+            return
+        wall = clock()
+        cpu = time.process_time()
+        usage = self._state_usage[self._state]
+        usage["seconds"] += wall - self._usage_wall
+        usage["cpu_seconds"] += cpu - self._usage_cpu
+        self._usage_wall = wall
+        self._usage_cpu = cpu
+
+    def set_state(self, state):
+        """
+        Switch the capture state.
+
+        Args:
+            state: One of CAPTURE_STATES
+        """
+        if state not in CAPTURE_STATES:
+            raise ValueError(f"Unknown capture state: {state}")
+        with self._state_lock:
+            if state == self._state:
+                return
+            self._account_usage()
+            self._state = state
+        self.state_changed.emit(state)
+
+    def get_state(self):
+        """Return the current capture state."""
+        return self._state
+
+    def get_state_usage(self):
+        """
+        Return the time, process CPU and inference rate spent in each capture state.
+
+        cpu_percent is relative to one core and includes every thread of the
+        process (grabbing, FaceMesh and the GUI) while the state was active.
+        """
+        with self._state_lock:
+            self._account_usage()
+            usage = {}
+            for state, values in self._state_usage.items():
+                seconds = values["seconds"]
+                usage[state] = dict(
+                    values,
+                    cpu_percent=100 * values["cpu_seconds"] / seconds if seconds else 0.0,
+                    fps=values["frames_processed"] / seconds if seconds else 0.0
+                )
+            return usage
+
+    def _publish(self, result):
+        """Queue a result for the GUI thread, dropping the oldest one when full."""
+        try:
+            self.results.put_nowait(result)
+        except queue.Full:
+            try:
+                self.results.get_nowait()
+                self.results_dropped += 1
+            except queue.Empty:
+                pass
+            self.results.put_nowait(result)
+        self.results_ready.emit()
+
+    def get_results(self):
+        """Return all results queued since the last call."""
+        results = []
+        while True:
+            try:
+                results.append(self.results.get_nowait())
+            except queue.Empty:
+                return results
+
+    def get_latest_result(self):
+        """Return only the newest queued result, discarding older ones."""
+        results = self.get_results()
+        return results[-1] if results else None
+
+    def get_stats(self):
+        """Return frame counters for each pipeline stage."""
+        grabber = self._grabber
+        stats = {
+            "frames_grabbed": grabber.frames_grabbed if grabber else 0,
+            "frames_dropped_grab": grabber.frames_dropped if grabber else 0,
+            "frames_processed": self.frames_processed,
+            "frames_dropped_results": self.results_dropped
+        }
+        if self.roi_tracker is not None:
+            stats["frames_cropped"] = self.roi_tracker.frames_cropped
+            stats["roi_redetections"] = self.roi_tracker.redetections
+        return stats
+
+    def stop(self):
+        """Stop capturing and wait for the camera to be released."""
+        self._stop_requested = True
+        self.wait()
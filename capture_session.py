@@ -0,0 +1,164 @@
+import logging
+import importlib
+import threading
+from PyQt5.QtCore import QObject, QTimer, pyqtSignal
+
+class CaptureSession(QObject):
+    """
+    Long-lived camera and FaceMesh pipeline shared by the application windows.
+
+    The capture engine is started once and kept running; windows subscribe to
+    its results instead of opening the camera themselves. Only one window is
+    subscribed at a time, and the engine idles while nobody is subscribed.
+    """
+    camera_opened = pyqtSignal()
+    camera_failed = pyqtSignal(str)
+    results_ready = pyqtSignal()
+    _engine_module_loaded = pyqtSignal()
+
+    def __init__(self, frame_source=None, roi_tracking=False, parent=None):
+        """
+        Initialize the capture session.
+
+        Args:
+            frame_source: FrameSource to capture from (default: see create_frame_source)
+            roi_tracking: Run FaceMesh on a crop around the tracked face
+            parent: Parent QObject
+        """
+        super().__init__(parent)
+        self.frame_source = frame_source
+        self.roi_tracking = roi_tracking
+        self.engine = None
+        self._subscription = None
+        self._warm_up_pending = False
+        self._engine_module_loaded.connect(self._on_engine_module_loaded)
+
+    def start(self):
+        """Start the capture engine if it is not running yet."""
+        if self.engine is not None and self.engine.isRunning():
+            return
+        # Imported on first use so creating a session does not load OpenCV and MediaPipe
+        from capture_engine import CaptureEngine
+        self.engine = CaptureEngine(frame_source=self.frame_source, state="idle",
+                                    roi_tracking=self.roi_tracking)
+        self.engine.camera_opened.connect(self.camera_opened)
+        self.engine.camera_failed.connect(self._on_camera_failed)
+        self.engine.results_ready.connect(self.results_ready)
+        self.engine.start()
+
+    def warm_up(self):
+        """
+        Open the camera and initialize FaceMesh ahead of the first subscriber.
+
+        capture_engine (and with it OpenCV) is imported on a background thread
+        so the GUI thread stays free; the engine starts once it is loaded.
+        """
+        if self.engine is not None and self.engine.isRunning():
+            return
+        self._warm_up_pending = True
+        threading.Thread(target=self._load_engine_module, daemon=True).start()
+
+    def _load_engine_module(self):
+        """Import capture_engine off the GUI thread, then start the engine from the GUI thread."""
+        try:
+            importlib.import_module("capture_engine")
+        except Exception as e:
+            logging.error(f"Error loading the capture engine: {str(e)}")
+            return
+        # Emitted from this thread, so the slot is queued to the GUI thread
+        self._engine_module_loaded.emit()
+
+    def _on_engine_module_loaded(self):
+        """Start the engine unless the session was stopped or subscribed in the meantime."""
+        if self._warm_up_pending:
+            self._warm_up_pending = False
+            self.start()
+
+    def _on_camera_failed(self, message):
+        """Drop the failed engine so the next subscription retries the camera."""
+        if self.engine is not None:
+            self.engine.wait()
+            self.engine = None
+        self.camera_failed.emit(message)
+
+    def is_camera_open(self):
+        """Check if the camera is open and frames are flowing."""
+        return self.engine is not None and self.engine.camera_open
+
+    def subscribe(self, on_results, on_failed=None, on_opened=None,
+                  flip=False, keep_frames=False, state="recording"):
+        """
+        Route the engine's results to a window, replacing the previous subscriber.
+
+        Args:
+            on_results: Slot called when results are queued; it reads them with
+                        engine.get_results() or engine.get_latest_result()
+            on_failed: Optional slot receiving camera failure messages
+            on_opened: Optional slot called once the camera is open (right away
+                       if it already is)
+            flip: Mirror frames horizontally before inference
+            keep_frames: Attach the processed frame to each result
+            state: Capture state while subscribed
+
+        Returns:
+            CaptureEngine: The running engine
+        """
+        if self._subscription is not None:
+            self.unsubscribe(self._subscription[0])
+        self.start()
+
+        engine = self.engine
+        engine.flip = flip
+        engine.keep_frames = keep_frames
+        # Results computed for the previous subscriber are not valid for this one
+        engine.get_results()
+        engine.set_state(state)
+
+        self.results_ready.connect(on_results)
+        if on_failed is not None:
+            self.camera_failed.connect(on_failed)
+        self._subscription = (on_results, on_failed, on_opened)
+
+        if on_opened is not None:
+            if self.is_camera_open():
+                QTimer.singleShot(0, on_opened)
+            else:
+                self.camera_opened.connect(on_opened)
+        return engine
+
+    def unsubscribe(self, on_results):
+        """
+        Stop delivering results to a subscriber and let the engine idle.
+
+        Args:
+            on_results: Slot passed to subscribe()
+        """
+        if self._subscription is None or self._subscription[0] != on_results:
+            return
+        on_results, on_failed, on_opened = self._subscription
+        self._subscription = None
+
+        self.results_ready.disconnect(on_results)
+        if on_failed is not None:
+            self.camera_failed.disconnect(on_failed)
+        if on_opened is not None:
+            try:
+                self.camera_opened.disconnect(on_opened)
+            except TypeError:
+                # Not connected because the camera was already open
+                pass
+
+        if self.engine is not None:
+            self.engine.stop_video()
+            self.engine.set_state("idle")
+            self.engine.get_results()
+
+    def stop(self):
+        """Stop the engine and release the camera."""
+        self._warm_up_pending = False
+        if self._subscription is not None:
+            self.unsubscribe(self._subscription[0])
+        if self.engine is not None:
+            self.engine.stop()
+            logging.info("Capture session stopped")
+            self.engine = None
@@ -0,0 +1,124 @@
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+from landmark_formats import CsvLandmarkFormat, NpzLandmarkFormat, read_landmark_csv
+
+def find_landmark_csvs(roots):
+    """
+    Find landmark CSV files under the given directories.
+
+    Matches trial files written by DataManager (landmark_data.csv) and
+    recordings saved by the standalone collector (*_landmarks.csv).
+    """
+    for root in roots:
+        root = Path(root)
+        yield from sorted(root.rglob(CsvLandmarkFormat.filename))
+        yield from sorted(root.rglob("*_landmarks.csv"))
+
+def is_up_to_date(csv_file, npz_file):
+    """Check if the binary output exists and is newer than its CSV source."""
+    return npz_file.exists() and npz_file.stat().st_mtime >= csv_file.stat().st_mtime
+
+def load_source_metadata(csv_file):
+    """Load the JSON metadata that belongs to a landmark CSV file, if any."""
+    if csv_file.name.endswith("_landmarks.csv"):
+        metadata_file = csv_file.with_name(csv_file.name.replace("_landmarks.csv", "_metadata.json"))
+    else:
+        metadata_file = csv_file.parent / "setup_config.json"
+
+    if metadata_file.exists():
+        with open(metadata_file) as f:
+            return json.load(f)
+    return {}
+
+def count_csv_rows(csv_file):
+    """Count the data rows of a CSV file without parsing the values."""
+    with open(csv_file, newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        return sum(1 for row in reader if row)
+
+def convert_file(csv_file):
+    """
+    Convert one landmark CSV file to .npz next to it and verify the row count.
+
+    Returns:
+        dict: Conversion report for the file
+    """
+    start = time.perf_counter()
+    npz_file = csv_file.with_suffix('.npz')
+    temp_file = csv_file.with_suffix('.tmp.npz')
+
+    store = read_landmark_csv(csv_file)
+    output = NpzLandmarkFormat(temp_file, None, load_source_metadata(csv_file))
+    output.write_batch(store)
+    output.close()
+
+    # Verify against an independent count of the source rows before replacing the output
+    expected_rows = count_csv_rows(csv_file)
+    with np.load(temp_file) as archive:
+        written_rows = len(archive['timestamps'])
+    if written_rows != expected_rows:
+        temp_file.unlink()
+        raise ValueError(f"Row count mismatch: {expected_rows} rows in CSV, {written_rows} converted")
+    os.replace(temp_file, npz_file)
+
+    return {
+        "file": str(csv_file),
+        "rows": written_rows,
+        "bytes": csv_file.stat().st_size,
+        "output_bytes": npz_file.stat().st_size,
+        "seconds": time.perf_counter() - start
+    }
+
+def main():
+    """Convert historical CSV sessions to compressed binary landmark files."""
+    parser = argparse.ArgumentParser(
+        description="Convert landmark CSV files in *_GazeEstimationExperiment folders to .npz in parallel.")
+    parser.add_argument("roots", nargs="+", help="Session directories or folders containing them")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes (default: all cores)")
+    parser.add_argument("--force", action="store_true",
+                        help="Convert files even if an up-to-date .npz exists")
+    args = parser.parse_args()
+
+    csv_files = list(find_landmark_csvs(args.roots))
+    pending = [f for f in csv_files if args.force or not is_up_to_date(f, f.with_suffix('.npz'))]
+    print(f"Found {len(csv_files)} CSV files, {len(csv_files) - len(pending)} already converted")
+
+    start = time.perf_counter()
+    total_rows = 0
+    total_bytes = 0
+    failures = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as executor:
+        futures = {executor.submit(convert_file, csv_file): csv_file for csv_file in pending}
+        for future in as_completed(futures):
+            csv_file = futures[future]
+            try:
+                report = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"FAILED {csv_file}: {str(e)}")
+                continue
+
+            total_rows += report["rows"]
+            total_bytes += report["bytes"]
+            seconds = max(report["seconds"], 1e-9)
+            print(f"{report['file']}: {report['rows']} rows, "
+                  f"{report['bytes'] / 1e6:.1f} MB -> {report['output_bytes'] / 1e6:.1f} MB in "
+                  f"{seconds:.2f} s ({report['rows'] / seconds:.0f} rows/s, "
+                  f"{report['bytes'] / 1e6 / seconds:.1f} MB/s)")
+
+    elapsed = max(time.perf_counter() - start, 1e-9)
+    print(f"Converted {len(pending) - failures} files ({total_rows} rows, {total_bytes / 1e6:.1f} MB) "
+          f"in {elapsed:.1f} s with {args.workers} workers, {failures} failed")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,24 +1,175 @@
+import os
 import json
 import csv
 from datetime import datetime
 import shutil
+import hashlib
 import logging
+import threading
 from pathlib import Path
+from landmark_store import LandmarkStore
+from landmark_formats import LANDMARK_FORMATS, open_landmark_outputs, save_landmark_store
+
+# Per-subject file holding the last allocated trial number
+TRIAL_SEQUENCE_FILE = "trial_sequence.txt"
+
+# Append-only JSON lines file with one record per trial state change
+SESSION_INDEX_FILE = "session_index.jsonl"
+
+def read_session_index(base_directory):
+    """
+    Read the records of a session index in the order they were written.
+    
+    Args:
+        base_directory: Session base directory holding the index
+        
+    Returns:
+        tuple: (records, torn) where torn is True if the last line was cut off
+               by a crash mid-write; unreadable lines are skipped
+    """
+    index_file = Path(base_directory) / SESSION_INDEX_FILE
+    try:
+        with open(index_file) as f:
+            lines = f.readlines()
+    except FileNotFoundError:
+        return [], False
+    
+    records = []
+    for line_number, line in enumerate(lines, 1):
+        try:
+            records.append(json.loads(line))
+        except ValueError:
+            # A torn last line from a crash mid-write
+            logging.warning(f"Skipping unreadable line {line_number} of {index_file}")
+    return records, bool(lines) and not lines[-1].endswith("\n")
+
+class TrialWriter:
+    """Streams landmark frames to the trial's output files from a background flush thread."""
+    
+    def __init__(self, outputs, schema, batch_size=100, flush_interval=1.0, max_pending=None):
+        """
+        Start the flush thread for already opened outputs.
+        
+        Args:
+            outputs: Opened landmark format writers (see landmark_formats)
+            schema: LandmarkSchema of the outputs; frames are reduced to its landmarks
+            batch_size: Pending frames that wake the flush thread early; a flush
+                        writes everything pending, up to max_pending frames
+            flush_interval: Maximum seconds a frame waits before being flushed
+            max_pending: Frames held while the disk falls behind, after which new
+                         frames are dropped and counted (default 10 batches)
+        """
+        self.outputs = outputs
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending if max_pending is not None else 10 * batch_size
+        self.rows_written = 0
+        self.frames_dropped = 0
+        self.error = None
+        
+        # Frames are added to the pending store and swapped out by the flush thread;
+        # both stores are reused so no per-frame allocation happens
+        self._pending = schema.create_store(chunk_size=batch_size)
+        self._spare = schema.create_store(chunk_size=batch_size)
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = False
+        
+        self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+        self._thread.start()
+    
+    def write_frame(self, timestamp, target_x, target_y, landmarks, timing=None):
+        """
+        Add a single frame for writing; timing holds the TIMING_FIELDS values.
+        
+        The caller is never blocked: while max_pending frames are waiting for
+        a slow disk, the frame is dropped and counted in frames_dropped.
+        """
+        if self._closed:
+            raise ValueError("Trial writer is closed")
+        with self._lock:
+            if len(self._pending) >= self.max_pending:
+                self.frames_dropped += 1
+                if self.frames_dropped == 1:
+                    logging.warning(f"Landmark writer is {self.max_pending} frames behind, dropping frames")
+                return
+            self._pending.append(timestamp, target_x, target_y, landmarks, timing)
+            batch_full = len(self._pending) >= self.batch_size
+        if batch_full:
+            self._wake.set()
+    
+    def _flush_loop(self):
+        """Swap out the pending frames and write them to disk."""
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            closing = self._closed
+            
+            with self._lock:
+                batch = self._pending
+                self._pending = self._spare
+            
+            if len(batch) and self.error is None:
+                try:
+                    for output in self.outputs:
+                        output.write_batch(batch)
+                    self.rows_written += len(batch)
+                except Exception as e:
+                    self.error = e
+                    logging.error(f"Error writing landmarks data: {str(e)}")
+            batch.clear()
+            self._spare = batch
+            
+            if closing:
+                return
+    
+    def close(self):
+        """Flush remaining frames and close the file."""
+        if self._closed:
+            return
+        self._closed = True
+        self._wake.set()
+        self._thread.join()
+        if self.frames_dropped:
+            logging.warning(f"Dropped {self.frames_dropped} landmark frames while the disk was behind")
+        for output in self.outputs:
+            try:
+                output.close()
+                logging.info(f"Saved {self.rows_written} landmark rows to {output.path}")
+            except Exception as e:
+                logging.error(f"Error closing landmarks file {output.path}: {str(e)}")
+                if self.error is None:
+                    self.error = e
+        
+        if self.error is not None:
+            raise self.error
 
 class DataManager:
     """Handles all data saving and organization for the gaze estimation experiment."""
     
-    def __init__(self, base_directory=None, app_version='1.0.0'):
+    def __init__(self, base_directory=None, app_version='1.0.0', output_formats=('csv',),
+                 record_video=False):
         """
         Initialize the data manager.
         
         Args:
             base_directory: Optional path to base directory
             app_version: Version string for the application
+            output_formats: Landmark file formats written for every trial
+                            ('csv', 'npz' and/or 'parquet')
+            record_video: Also store the raw camera video of every trial for
+                          offline re-processing (requires matching consent)
         """
         # Store app version
         self.app_version = app_version
         
+        # Validate the landmark output formats for this session
+        unknown_formats = set(output_formats) - set(LANDMARK_FORMATS)
+        if unknown_formats:
+            raise ValueError(f"Unknown landmark output formats: {sorted(unknown_formats)}")
+        self.output_formats = list(output_formats)
+        self.record_video = record_video
+        
         # Set up base directory
         if base_directory is None:
             self.base_directory = self._create_base_directory()
@@ -28,6 +179,14 @@ class DataManager:
         # Set up logging
         self._setup_logging()
         
+        # Latest session index record per trial and completed setups per subject,
+        # read from the index file on first use
+        self._session_index = None
+        self._completed_setups = None
+        
+        # Last trial number allocated per subject directory
+        self._trial_counters = {}
+        
     def _setup_logging(self):
         """Configure logging for the data manager."""
         log_file = self.base_directory / 'experiment.log'
@@ -58,16 +217,51 @@ class DataManager:
             logging.error(f"Error creating subject directory: {str(e)}")
             raise
     
+    def _read_trial_sequence(self, subject_dir):
+        """
+        Return the last trial number allocated for a subject.
+        
+        The number comes from the in-memory counter or the subject's sequence
+        file; folders are only scanned once for subjects recorded before the
+        sequence file existed.
+        """
+        cached = self._trial_counters.get(subject_dir, 0)
+        try:
+            stored = int((subject_dir / TRIAL_SEQUENCE_FILE).read_text())
+        except FileNotFoundError:
+            stored = max((int(d.name[6:]) for d in subject_dir.glob("Trial_*") if d.name[6:].isdigit()),
+                         default=0)
+        except ValueError:
+            logging.warning(f"Ignoring corrupt trial sequence file in {subject_dir}")
+            stored = 0
+        return max(cached, stored)
+    
+    def _write_trial_sequence(self, subject_dir, trial_num):
+        """Atomically replace the subject's sequence file with the last allocated trial number."""
+        sequence_file = subject_dir / TRIAL_SEQUENCE_FILE
+        temp_file = subject_dir / f"{TRIAL_SEQUENCE_FILE}.{os.getpid()}.{threading.get_ident()}.tmp"
+        temp_file.write_text(str(trial_num))
+        os.replace(temp_file, sequence_file)
+        self._trial_counters[subject_dir] = trial_num
+    
     def create_trial_directory(self, subject_dir):
-        """Create a new trial directory with incrementing trial number."""
+        """
+        Create a new trial directory with incrementing trial number.
+        
+        Numbers are claimed with an exclusive mkdir, so two processes writing
+        the same subject never share a trial; a number taken by another
+        process is skipped.
+        """
         try:
-            # Find existing trial directories
-            existing_trials = list(subject_dir.glob("Trial_*"))
-            trial_num = len(existing_trials) + 1
-            
-            # Create new trial directory
-            trial_dir = subject_dir / f"Trial_{str(trial_num).zfill(3)}"
-            trial_dir.mkdir(exist_ok=True)
+            trial_num = self._read_trial_sequence(subject_dir) + 1
+            while True:
+                trial_dir = subject_dir / f"Trial_{str(trial_num).zfill(3)}"
+                try:
+                    trial_dir.mkdir()
+                    break
+                except FileExistsError:
+                    trial_num += 1
+            self._write_trial_sequence(subject_dir, trial_num)
             
             logging.info(f"Created trial directory: {trial_dir}")
             return trial_dir
@@ -89,6 +283,136 @@ class DataManager:
             logging.error(f"Error saving metadata: {str(e)}")
             raise
     
+    def load_system_profile(self, key):
+        """
+        Load the cached system profile of the session.
+        
+        Args:
+            key: Dictionary identifying the hostname, camera and monitors
+            
+        Returns:
+            dict: Cached system info, or None if there is none for this key
+        """
+        profile_file = self.base_directory / "system_profile.json"
+        try:
+            with open(profile_file) as f:
+                profile = json.load(f)
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.warning(f"Ignoring unreadable system profile: {str(e)}")
+            return None
+        
+        if profile.get("key") != key:
+            logging.info("Hardware setup changed since the system profile was cached")
+            return None
+        return profile["system_info"]
+    
+    def save_system_profile(self, key, system_info):
+        """
+        Cache the system profile so later subjects and sessions can reuse it.
+        
+        Args:
+            key: Dictionary identifying the hostname, camera and monitors
+            system_info: Collected laptop, camera and screen information
+        """
+        try:
+            profile_file = self.base_directory / "system_profile.json"
+            temp_file = profile_file.with_suffix('.tmp')
+            with open(temp_file, 'w') as f:
+                json.dump({
+                    "key": key,
+                    "collected": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                    "system_info": system_info
+                }, f, indent=2)
+            os.replace(temp_file, profile_file)
+            
+            logging.info(f"Saved system profile to {profile_file}")
+            
+        except Exception as e:
+            logging.error(f"Error saving system profile: {str(e)}")
+            raise
+    
+    def _load_session_index(self):
+        """Read the append-only session index; later records of a trial supersede earlier ones."""
+        self._session_index = {}
+        self._completed_setups = {}
+        # The next record starts on a fresh line after a torn write
+        records, self._index_torn = read_session_index(self.base_directory)
+        for record in records:
+            self._index_record(record)
+    
+    def _index_record(self, record):
+        """Add a session index record to the in-memory lookups."""
+        self._session_index[(record["subject"], record["trial"])] = record
+        if record["status"] == "completed":
+            combination = (record["yaw"], record["pitch"], record["distance"])
+            self._completed_setups.setdefault(record["subject"], set()).add(combination)
+    
+    def record_trial(self, trial_dir, setup, status, rows=None, files=(), frames_dropped=None):
+        """
+        Append a trial's state to the session index.
+        
+        Args:
+            trial_dir: Path to trial directory
+            setup: trial_config['setup'] with yaw, pitch and distance
+            status: "started", "completed" or "aborted"
+            rows: Number of landmark rows written
+            files: Output files covered by the checksum
+            frames_dropped: Frames the landmark writer dropped while the disk
+                            was behind; such a trial has gaps in its rows
+        """
+        try:
+            if self._session_index is None:
+                self._load_session_index()
+            
+            checksum = None
+            if files:
+                digest = hashlib.sha256()
+                for path in files:
+                    with open(path, 'rb') as f:
+                        for block in iter(lambda: f.read(1 << 20), b''):
+                            digest.update(block)
+                checksum = f"sha256:{digest.hexdigest()}"
+            
+            record = {
+                "time": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "subject": trial_dir.parent.name,
+                "trial": trial_dir.name,
+                "yaw": setup["yaw"],
+                "pitch": setup["pitch"],
+                "distance": setup["distance"],
+                "rows": rows,
+                "frames_dropped": frames_dropped,
+                "status": status,
+                "checksum": checksum
+            }
+            
+            # One line per write so concurrent appends do not interleave
+            index_file = self.base_directory / SESSION_INDEX_FILE
+            with open(index_file, 'a') as f:
+                f.write(("\n" if self._index_torn else "") + json.dumps(record) + "\n")
+                self._index_torn = False
+                f.flush()
+                os.fsync(f.fileno())
+            self._index_record(record)
+            
+            logging.info(f"Recorded trial {trial_dir.name} as {status} in {index_file}")
+            
+        except Exception as e:
+            logging.error(f"Error recording trial in session index: {str(e)}")
+            raise
+    
+    def get_completed_setups(self, subject_dir):
+        """Return the (yaw, pitch, distance) combinations the subject has completed."""
+        try:
+            if self._session_index is None:
+                self._load_session_index()
+            return set(self._completed_setups.get(subject_dir.name, ()))
+        except Exception as e:
+            logging.error(f"Error reading session index: {str(e)}")
+            return set()
+    
     def save_trial_config(self, trial_dir, config):
         """Save trial configuration including setup parameters."""
         try:
@@ -102,13 +426,30 @@ class DataManager:
             logging.error(f"Error saving trial configuration: {str(e)}")
             raise
     
-    def save_landmark_data(self, trial_dir, landmarks_data, column_names):
-        """Save landmarks data to CSV file."""
+    def _open_landmark_outputs(self, trial_dir, schema, metadata):
+        """Open one writer per configured landmark output format."""
+        return open_landmark_outputs(trial_dir, schema, metadata, self.output_formats)
+    
+    def save_landmark_data(self, trial_dir, landmarks_data, schema=None, metadata=None):
+        """
+        Save landmarks data to the trial directory.
+        
+        A LandmarkStore is written in every configured output format, by
+        default with the schema of its landmarks; a list of rows can only be
+        written as CSV and needs the schema of its columns.
+        """
         try:
+            if isinstance(landmarks_data, LandmarkStore):
+                paths = save_landmark_store(trial_dir, landmarks_data, self.output_formats, schema, metadata)
+                
+                logging.info(f"Saved landmarks data to {[str(path) for path in paths]}")
+                return
+            
             landmarks_file = trial_dir / "landmark_data.csv"
+            schema.write_sidecar(landmarks_file)
             with open(landmarks_file, 'w', newline='') as f:
                 writer = csv.writer(f)
-                writer.writerow(column_names)
+                writer.writerow(schema.column_names)
                 writer.writerows(landmarks_data)
             
             logging.info(f"Saved landmarks data to {landmarks_file}")
@@ -117,6 +458,66 @@ class DataManager:
             logging.error(f"Error saving landmarks data: {str(e)}")
             raise
     
+    def open_landmark_writer(self, trial_dir, schema, metadata=None, batch_size=100):
+        """
+        Open a streaming writer for the trial's landmark files in every configured format.
+        
+        The LandmarkSchema names the columns of every output and selects the
+        landmarks kept from every frame.
+        """
+        try:
+            outputs = self._open_landmark_outputs(trial_dir, schema, metadata or {})
+            writer = TrialWriter(outputs, schema, batch_size=batch_size)
+            
+            logging.info(f"Opened landmarks stream to {[str(o.path) for o in outputs]}")
+            return writer
+            
+        except Exception as e:
+            logging.error(f"Error opening landmarks stream: {str(e)}")
+            raise
+    
+    def get_video_path(self, trial_dir):
+        """Return the raw video path for a trial, or None if video recording is disabled."""
+        return trial_dir / "video.avi" if self.record_video else None
+    
+    def save_target_timeline(self, trial_dir, timeline):
+        """Save the (onset, offset, target_x, target_y) segments of every displayed dot."""
+        try:
+            timeline_file = trial_dir / "target_timeline.csv"
+            with open(timeline_file, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(["onset", "offset", "target_x", "target_y"])
+                writer.writerows(timeline)
+            
+            logging.info(f"Saved target timeline to {timeline_file}")
+            
+        except Exception as e:
+            logging.error(f"Error saving target timeline: {str(e)}")
+            raise
+    
+    def save_stimulus_events(self, trial_dir, events):
+        """
+        Save the stimulus event log of a trial.
+        
+        Args:
+            trial_dir: Path to trial directory
+            events: List of [time, clock_time, deadline, event, dot_number, target_x, target_y]
+                    rows; time matches the landmark timestamps, clock_time their capture_time
+                    and deadline is the scheduled clock time (empty for unscheduled events)
+        """
+        try:
+            events_file = trial_dir / "stimulus_events.csv"
+            with open(events_file, 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(["time", "clock_time", "deadline", "event", "dot_number", "target_x", "target_y"])
+                writer.writerows(events)
+            
+            logging.info(f"Saved {len(events)} stimulus events to {events_file}")
+            
+        except Exception as e:
+            logging.error(f"Error saving stimulus events: {str(e)}")
+            raise
+    
     def save_experiment_data(self, trial_dir, data):
         """Save experiment-specific data to CSV file."""
         try:
@@ -133,9 +534,9 @@ class DataManager:
             raise
 
     def get_trial_count(self, subject_dir):
-        """Get the number of existing trials for a subject."""
+        """Get the number of the last trial allocated for a subject."""
         try:
-            return len(list(subject_dir.glob("Trial_*")))
+            return self._read_trial_sequence(subject_dir)
         except Exception as e:
             logging.error(f"Error counting trials: {str(e)}")
             return 0
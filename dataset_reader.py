@@ -0,0 +1,254 @@
+import sys
+import json
+import logging
+import argparse
+from pathlib import Path
+import numpy as np
+from landmark_formats import read_trial_landmarks, NpzLandmarkFormat, CsvLandmarkFormat
+from data_manager import read_session_index
+
+DATASET_DIRNAME = "dataset"
+
+# One record per trial; start/stop are the trial's frame range in the arrays
+INDEX_DTYPE = np.dtype([
+    ('subject', 'U16'),
+    ('trial', 'U16'),
+    ('yaw', 'f4'),
+    ('pitch', 'f4'),
+    ('distance', 'f4'),
+    ('start', 'i8'),
+    ('stop', 'i8')
+])
+
+def read_trial_statuses(session_dir):
+    """
+    Read the latest status of every trial from the session index.
+
+    Returns:
+        dict: (subject, trial) -> "started", "completed" or "aborted"; empty
+              for sessions recorded before the index existed
+    """
+    records, _ = read_session_index(session_dir)
+    # Later records of a trial supersede earlier ones
+    return {(record["subject"], record["trial"]): record["status"] for record in records}
+
+def list_source_trials(session_dir):
+    """
+    List the trials a conversion reads, with the state of their input files.
+
+    Trials the session index marks as aborted are left out. The result is
+    stored in dataset.json, so a changed, added or removed trial shows up as
+    a different list.
+
+    Returns:
+        list: One dict per trial with its path, status and [name, mtime_ns, size]
+              of its setup and landmark files
+    """
+    session_dir = Path(session_dir)
+    statuses = read_trial_statuses(session_dir)
+    trials = []
+    for trial_dir in sorted(session_dir.glob("S*/Trial_*")):
+        status = statuses.get((trial_dir.parent.name, trial_dir.name))
+        if status == "aborted":
+            continue
+        files = []
+        # The same files read_trial_landmarks picks
+        for name in ("setup_config.json", NpzLandmarkFormat.filename, CsvLandmarkFormat.filename):
+            path = trial_dir / name
+            if path.exists():
+                stat = path.stat()
+                files.append([name, stat.st_mtime_ns, stat.st_size])
+        trials.append({
+            "trial": f"{trial_dir.parent.name}/{trial_dir.name}",
+            "status": status,
+            "files": files
+        })
+    return trials
+
+def convert_session(session_dir, output_dir=None):
+    """
+    Convert a YYYYMMDD_GazeEstimationExperiment tree into memory-mappable arrays.
+
+    Every S###/Trial_### folder with a setup_config.json and landmark data is
+    appended to flat landmark, timestamp and target files, and its frame range
+    is recorded in the index together with the trial setup. Trials the session
+    index marks as aborted are skipped.
+
+    Args:
+        session_dir: Session base directory written by DataManager
+        output_dir: Where to write the dataset (defaults to <session_dir>/dataset)
+
+    Returns:
+        GazeDataset: Reader over the converted data
+    """
+    session_dir = Path(session_dir)
+    output_dir = Path(output_dir) if output_dir is not None else session_dir / DATASET_DIRNAME
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    # Remove a previous description first so a partial conversion is never loaded
+    info_file = output_dir / "dataset.json"
+    if info_file.exists():
+        info_file.unlink()
+
+    source_trials = list_source_trials(session_dir)
+    entries = []
+    num_landmarks = None
+    landmark_indices = None
+    num_frames = 0
+    with open(output_dir / "landmarks.f32", 'wb') as landmarks_file, \
+         open(output_dir / "timestamps.f64", 'wb') as timestamps_file, \
+         open(output_dir / "targets.f32", 'wb') as targets_file:
+
+        for source in source_trials:
+            trial_dir = session_dir / source["trial"]
+            config_file = trial_dir / "setup_config.json"
+            if not config_file.exists():
+                continue
+            store = read_trial_landmarks(trial_dir)
+            if store is None or len(store) == 0:
+                continue
+
+            if num_landmarks is None:
+                num_landmarks = store.num_landmarks
+                landmark_indices = store.get_landmark_indices()
+            elif store.num_landmarks != num_landmarks or \
+                    not np.array_equal(store.get_landmark_indices(), landmark_indices):
+                logging.warning(f"Skipping {trial_dir}: {store.num_landmarks} landmarks, "
+                                f"expected {num_landmarks} with the first trial's subset")
+                continue
+
+            with open(config_file) as f:
+                setup = json.load(f).get("setup", {})
+
+            landmarks_file.write(store.get_landmarks().tobytes())
+            timestamps_file.write(store.get_timestamps().tobytes())
+            targets_file.write(store.get_targets().tobytes())
+
+            entries.append((
+                trial_dir.parent.name,
+                trial_dir.name,
+                setup.get("yaw", np.nan),
+                setup.get("pitch", np.nan),
+                setup.get("distance", np.nan),
+                num_frames,
+                num_frames + len(store)
+            ))
+            num_frames += len(store)
+
+    np.save(output_dir / "index.npy", np.array(entries, dtype=INDEX_DTYPE))
+    with open(info_file, 'w') as f:
+        json.dump({
+            "source": str(session_dir),
+            "num_frames": num_frames,
+            "num_landmarks": num_landmarks or 0,
+            "landmark_indices": landmark_indices.tolist() if landmark_indices is not None else [],
+            "num_trials": len(entries),
+            "source_trials": source_trials
+        }, f, indent=2)
+
+    logging.info(f"Converted {len(entries)} trials ({num_frames} frames) to {output_dir}")
+    return GazeDataset(output_dir)
+
+def load_dataset(session_dir, output_dir=None):
+    """Open the converted dataset of a session, converting it again if its trials changed."""
+    session_dir = Path(session_dir)
+    output_dir = Path(output_dir) if output_dir is not None else session_dir / DATASET_DIRNAME
+    info_file = output_dir / "dataset.json"
+    if info_file.exists():
+        # Compare before mapping, as a conversion rewrites the array files
+        with open(info_file) as f:
+            info = json.load(f)
+        if info.get("source_trials") == list_source_trials(session_dir):
+            return GazeDataset(output_dir)
+        logging.info(f"Trials of {session_dir} changed since {output_dir} was converted")
+    return convert_session(session_dir, output_dir)
+
+class GazeDataset:
+    """Read-only, memory-mapped view of a converted session."""
+
+    def __init__(self, dataset_dir):
+        """
+        Open a converted dataset.
+
+        Args:
+            dataset_dir: Directory written by convert_session
+        """
+        self.dataset_dir = Path(dataset_dir)
+        with open(self.dataset_dir / "dataset.json") as f:
+            self.info = json.load(f)
+
+        self.num_frames = self.info["num_frames"]
+        self.num_landmarks = self.info["num_landmarks"]
+        self.index = np.load(self.dataset_dir / "index.npy")
+
+        self.landmarks = self._map("landmarks.f32", np.float32, (self.num_landmarks, 3))
+        self.timestamps = self._map("timestamps.f64", np.float64, ())
+        self.targets = self._map("targets.f32", np.float32, (2,))
+
+    def _map(self, filename, dtype, frame_shape):
+        """Memory-map one of the flat array files."""
+        shape = (self.num_frames,) + frame_shape
+        if self.num_frames == 0:
+            return np.empty(shape, dtype=dtype)
+        return np.memmap(self.dataset_dir / filename, dtype=dtype, mode='r', shape=shape)
+
+    def __len__(self):
+        return self.num_frames
+
+    def select(self, subject=None, yaw=None, pitch=None, distance=None):
+        """
+        Return the index entries matching the given setup.
+
+        Each argument may be a single value or a list of accepted values;
+        None accepts everything.
+        """
+        mask = np.ones(len(self.index), dtype=bool)
+        for field, value in (('subject', subject), ('yaw', yaw),
+                             ('pitch', pitch), ('distance', distance)):
+            if value is not None:
+                mask &= np.isin(self.index[field], np.atleast_1d(value))
+        return self.index[mask]
+
+    def get_trial(self, entry):
+        """Return views of the landmarks, timestamps and targets of one index entry."""
+        start, stop = int(entry['start']), int(entry['stop'])
+        return {
+            "landmarks": self.landmarks[start:stop],
+            "timestamps": self.timestamps[start:stop],
+            "targets": self.targets[start:stop]
+        }
+
+    def iter_batches(self, batch_size=256, **filters):
+        """
+        Yield batches of frames for the trials matching the filters.
+
+        Batches never span two trials, so every batch is a zero-copy slice
+        of the memory-mapped arrays. Filters are passed on to select().
+        """
+        for entry in self.select(**filters):
+            for start in range(int(entry['start']), int(entry['stop']), batch_size):
+                stop = min(start + batch_size, int(entry['stop']))
+                yield {
+                    "entry": entry,
+                    "landmarks": self.landmarks[start:stop],
+                    "timestamps": self.timestamps[start:stop],
+                    "targets": self.targets[start:stop]
+                }
+
+def main():
+    """Convert a session tree and print a summary of the resulting dataset."""
+    parser = argparse.ArgumentParser(description="Convert a gaze session into a memory-mapped dataset.")
+    parser.add_argument("session_dir", help="YYYYMMDD_GazeEstimationExperiment directory")
+    parser.add_argument("--output", help="Dataset directory (default: <session_dir>/dataset)")
+    args = parser.parse_args()
+
+    dataset = convert_session(args.session_dir, args.output)
+    print(f"{len(dataset.index)} trials, {len(dataset)} frames, "
+          f"{dataset.num_landmarks} landmarks per frame")
+    for entry in dataset.index:
+        print(f"{entry['subject']}/{entry['trial']}: yaw {entry['yaw']:g}, pitch {entry['pitch']:g}, "
+              f"distance {entry['distance']:g} cm, {entry['stop'] - entry['start']} frames")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
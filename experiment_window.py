@@ -1,18 +1,23 @@
 import sys
+import logging
 from datetime import datetime
 import random
 from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QLabel, 
                             QPushButton, QMessageBox, QApplication)
 from PyQt5.QtCore import Qt, QTimer, QPoint, pyqtSignal
 from PyQt5.QtGui import QPainter, QColor, QPen
-import cv2
-import mediapipe as mp
+from capture_session import CaptureSession
+from frame_source import clock, clock_to_unix
+from landmark_store import face_mesh_landmark_count
+from landmark_formats import LandmarkSchema
+from landmark_subsets import resolve_landmark_subset
+from stimulus_scheduler import StimulusScheduler, build_trial_schedule
 
 class ExperimentWindow(QWidget):
     """Window for providing stimuli and running the gaze experiment and collecting data."""
     finished = pyqtSignal()
     
-    def __init__(self, data_manager, trial_dir, trial_config, parent=None):
+    def __init__(self, data_manager, trial_dir, trial_config, capture_session=None, parent=None):
         """
         Initialize the experiment window.
         
@@ -20,19 +25,38 @@ class ExperimentWindow(QWidget):
             data_manager: DataManager instance for saving data
             trial_dir: Path object pointing to the trial directory
             trial_config: Dictionary containing trial configuration
+            capture_session: Shared CaptureSession; a private one is used if None
             parent: Parent widget
         """
         super().__init__(parent)
         self.data_manager = data_manager
         self.trial_dir = trial_dir
         self.trial_config = trial_config
+        self.owns_capture_session = capture_session is None
+        self.capture_session = capture_session if capture_session is not None else CaptureSession()
         
         # Initialize experimental state
-        self.camera = None
-        self.mp_face_mesh = None
+        self.capture_engine = None
+        self.camera_was_open = False
+        self.state_usage_start = None
         self.current_dot_position = None
-        self.landmarks_data = []
+        self.landmark_writer = None
+        self.frames_dropped = 0
         self.is_center_point = False
+        
+        # [onset, offset, target_x, target_y] of every dot on the frame capture
+        # clock; results are labelled by the dot shown when their frame was captured
+        self.dot_segments = []
+        
+        # Dot segments are only saved when raw video is recorded for re-processing
+        self.video_path = data_manager.get_video_path(trial_dir)
+        self.target_timeline_pending = self.video_path is not None
+
+        # Stimulus events with their time on the frame capture clock
+        self.stimulus_events = []
+        self.dot_number = 0
+        self.paint_event_pending = None
+        self.scheduler = StimulusScheduler(self)
 
         # Get parameters from trial config
         conditions = trial_config['conditions']
@@ -50,7 +74,7 @@ class ExperimentWindow(QWidget):
         
         # Setup UI and start experiment
         self.setup_ui()
-        self.setup_mediapipe()
+        self.setup_landmark_writer()
         self.setup_camera()
 
     def calculate_center_point(self):
@@ -87,30 +111,143 @@ class ExperimentWindow(QWidget):
         self.status_label.setStyleSheet("color: gray; font-size: 24px;")
         layout.addWidget(self.status_label)
         
-    def setup_mediapipe(self):
-        """Initialize MediaPipe face mesh."""
-        self.mp_face_mesh = mp.solutions.face_mesh.FaceMesh(
-            max_num_faces=1,
-            refine_landmarks=True,
-            min_detection_confidence=0.5,
-            min_tracking_confidence=0.5
+    def setup_landmark_writer(self):
+        """Open the streaming landmark file so rows reach disk as they are recorded."""
+        # Columns follow the landmarks FaceMesh produces, reduced to the trial's subset
+        num_landmarks = face_mesh_landmark_count()
+        schema = LandmarkSchema.get(
+            num_landmarks,
+            resolve_landmark_subset(self.trial_config.get('landmark_subset'), num_landmarks)
         )
         
-    def setup_camera(self):
-        """Initialize the camera and start capture."""
-        self.camera = cv2.VideoCapture(0)
-        if not self.camera.isOpened():
-            QMessageBox.critical(self, "Error", "Failed to open camera!")
-            self.close()
-            return
+        self.landmark_writer = self.data_manager.open_landmark_writer(
+            self.trial_dir,
+            schema,
+            metadata=self.trial_config
+        )
         
-        # Start timers for camera capture and experiment
-        self.capture_timer = QTimer()
-        self.capture_timer.timeout.connect(self.process_frame)
-        self.capture_timer.start(33)  # ~30 fps
+    def close_landmark_writer(self, status="aborted"):
+        """
+        Flush the remaining rows, finalize the landmark file and record the trial.
+        
+        The timeline and stimulus events are saved and the trial is recorded
+        even if the landmark file cannot be finalized; the trial is then
+        recorded as aborted and the error raised afterwards.
         
-        # Start experiment
-        QTimer.singleShot(1000, self.start_experiment)
+        Args:
+            status: Trial status recorded in the session index
+        """
+        writer = self.landmark_writer
+        close_error = None
+        if writer is not None:
+            self.landmark_writer = None
+            self.frames_dropped = writer.frames_dropped
+            try:
+                writer.close()
+            except Exception as e:
+                close_error = e
+                status = "aborted"
+        
+        try:
+            # Close a dot that was still showing when the trial was aborted
+            if self.dot_segments and self.dot_segments[-1][1] is None:
+                self.dot_segments[-1][1] = clock()
+            
+            if self.target_timeline_pending:
+                self.target_timeline_pending = False
+                timeline = [[clock_to_unix(onset), clock_to_unix(offset), target_x, target_y]
+                            for onset, offset, target_x, target_y in self.dot_segments]
+                self.data_manager.save_target_timeline(self.trial_dir, timeline)
+        finally:
+            try:
+                if self.stimulus_events is not None:
+                    events = self.stimulus_events
+                    self.stimulus_events = None
+                    self.data_manager.save_stimulus_events(self.trial_dir, events)
+            finally:
+                if writer is not None:
+                    # A failed landmark file is not covered by a checksum
+                    files = [output.path for output in writer.outputs] if close_error is None else ()
+                    self.data_manager.record_trial(self.trial_dir, self.trial_config['setup'], status,
+                                                   writer.rows_written, files, writer.frames_dropped)
+        
+        if close_error is not None:
+            raise close_error
+        
+    def log_event(self, event, deadline=None):
+        """
+        Record a stimulus event for the current dot.
+        
+        Args:
+            event: Event name, e.g. "dot_onset" or "dot_painted"
+            deadline: Scheduled clock() time of the event, if it was scheduled
+        """
+        if self.stimulus_events is None:
+            return
+        now = clock()
+        target_x = target_y = None
+        if self.current_dot_position is not None:
+            target_x = self.current_dot_position[0] * self.width()
+            target_y = self.current_dot_position[1] * self.height()
+        self.stimulus_events.append([clock_to_unix(now), now, deadline, event,
+                                     self.dot_number, target_x, target_y])
+        
+    def setup_camera(self):
+        """Subscribe to the capture session that owns the camera and FaceMesh."""
+        self.camera_was_open = self.capture_session.is_camera_open()
+        # FaceMesh runs at full rate from the start so tracking is settled at the first dot
+        self.capture_engine = self.capture_session.subscribe(
+            self.process_frame,
+            on_failed=self.on_camera_failed,
+            on_opened=self.on_camera_opened,
+            state="warmup"
+        )
+        # The engine is shared across trials; this trial's usage is the difference
+        self.state_usage_start = self.capture_engine.get_state_usage()
+        if self.video_path is not None:
+            self.capture_engine.start_video(self.video_path)
+
+    def log_state_usage(self):
+        """Log the time, CPU and inference rate of each capture state during this trial."""
+        if self.capture_engine is None or self.state_usage_start is None:
+            return
+        usage = {}
+        for state, values in self.capture_engine.get_state_usage().items():
+            start = self.state_usage_start[state]
+            seconds = values["seconds"] - start["seconds"]
+            if seconds <= 0:
+                continue
+            cpu_seconds = values["cpu_seconds"] - start["cpu_seconds"]
+            frames = values["frames_processed"] - start["frames_processed"]
+            usage[state] = {
+                "seconds": round(seconds, 2),
+                "cpu_percent": round(100 * cpu_seconds / seconds, 1),
+                "fps": round(frames / seconds, 1)
+            }
+        logging.info(f"Capture state usage for {self.trial_dir.name}: {usage}")
+
+    def stop_capture(self):
+        """Stop receiving results; the camera is only released if the session is private."""
+        if self.capture_engine is not None:
+            self.capture_session.unsubscribe(self.process_frame)
+            self.capture_engine = None
+            if self.owns_capture_session:
+                self.capture_session.stop()
+
+    def set_capture_state(self, state):
+        """Switch the capture engine between recording and warm rest tracking."""
+        if self.capture_engine is not None:
+            self.capture_engine.set_state(state)
+
+    def on_camera_opened(self):
+        """Start the experiment once the capture engine is running."""
+        # A freshly opened camera needs a moment to settle its exposure
+        QTimer.singleShot(0 if self.camera_was_open else 1000, self.start_experiment)
+
+    def on_camera_failed(self, message):
+        """Report a camera failure from the capture engine."""
+        QMessageBox.critical(self, "Error", message)
+        self.close()
         
     def generate_grid_points(self):
         """Generate grid points for dot display with margins."""
@@ -149,17 +286,36 @@ class ExperimentWindow(QWidget):
 Click OK when you're ready to begin.""")
 
         self.status_label.setText("Experiment starting...")
-        self.show_next_dot()
+        self.log_event("trial_start")
+        
+        # All onsets and offsets are fixed up front relative to the trial start
+        actions = {
+            "dot_onset": self.show_next_dot,
+            "dot_offset": self.rest_period,
+            "trial_end": self.show_next_dot
+        }
+        schedule = build_trial_schedule(self.trial_config['conditions'], len(self.grid_points))
+        self.scheduler.start([(offset, actions[action]) for offset, action in schedule])
 
-    def show_next_dot(self):
-        """Display the next dot in the sequence."""
+    def show_next_dot(self, deadline=None):
+        """
+        Display the next dot in the sequence, or finish after the last one.
+        
+        Args:
+            deadline: Scheduled clock() time of the onset
+        """
+        if self.dot_number:
+            self.log_event("rest_end", deadline)
         if not self.remaining_points:
+            self.log_event("trial_end", deadline)
             self.finish_experiment()
             return
             
         # Select random point from remaining points
         point_idx = random.randint(0, len(self.remaining_points) - 1)
         self.current_dot_position = self.remaining_points.pop(point_idx)
+        self.dot_number += 1
+        self.set_capture_state("recording")
         
         # Check if this is the center point
         self.is_center_point = (self.current_dot_position == self.center_point)
@@ -170,54 +326,86 @@ Click OK when you're ready to begin.""")
         status_text = "\n😊 smile! 😊" if self.is_center_point else "" # f"Please look at the dot ({total_points - points_left}/{total_points})"
         self.status_label.setText(status_text)
         
-        # Schedule next dot
-        QTimer.singleShot(self.dot_display_time, self.rest_period)
+        self.log_event("dot_onset", deadline)
+        if self.is_center_point:
+            self.log_event("smile_cue", deadline)
+        self.paint_event_pending = "dot_painted"
+        
+        # Remember when and where the dot was shown, on the frame capture clock
+        self.dot_segments.append([
+            clock(), None,
+            self.current_dot_position[0] * self.width(),
+            self.current_dot_position[1] * self.height()
+        ])
         
         # Force repaint to show new dot
         self.update()
         
-    def rest_period(self):
-        """Insert a rest period between dots."""
+    def rest_period(self, deadline=None):
+        """
+        Insert a rest period between dots.
+        
+        Args:
+            deadline: Scheduled clock() time of the dot offset
+        """
+        self.log_event("dot_offset", deadline)
         self.current_dot_position = None
+        self.set_capture_state("rest")
+        self.log_event("rest_start", deadline)
+        self.paint_event_pending = "dot_cleared"
+        if self.dot_segments:
+            self.dot_segments[-1][1] = clock()
         # self.status_label.setText("Rest...")
         self.update()
         
-        QTimer.singleShot(self.rest_time, self.show_next_dot)
-        
     def process_frame(self):
-        """Process each camera frame and extract landmarks."""
-        if self.camera is None or self.current_dot_position is None:
+        """Collect landmark results delivered by the capture engine."""
+        if self.capture_engine is None or self.landmark_writer is None:
             return
             
-        ret, frame = self.camera.read()
-        if not ret:
-            return
+        # Always drain the queue; results arrive after a pipeline delay, so the
+        # target comes from the capture time, not from the dot shown right now
+        for result in self.capture_engine.get_results():
+            if result.landmarks is None:
+                continue
             
-        # Process frame with MediaPipe
-        frame_rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        results = self.mp_face_mesh.process(frame_rgb)
+            # Frames captured during a rest period are discarded
+            target = self.get_target_at(result.capture_time)
+            if target is None:
+                continue
+            self.landmark_writer.write_frame(result.timestamp, target[0], target[1],
+                                             result.landmarks, result.timing)
+    
+    def get_target_at(self, capture_time):
+        """
+        Look up the dot that was shown at a frame's capture time.
         
-        if results.multi_face_landmarks:
-            landmarks = results.multi_face_landmarks[0]
-            
-            # Record timestamp and current dot position
-            timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S.%f")
-            dot_x = self.current_dot_position[0] * self.width()
-            dot_y = self.current_dot_position[1] * self.height()
-            
-            # Prepare landmark data
-            landmark_row = [timestamp, dot_x, dot_y]
-            
-            # Add all landmark coordinates
-            for landmark in landmarks.landmark:
-                landmark_row.extend([landmark.x, landmark.y, landmark.z])
+        Args:
+            capture_time: clock() reading taken when the frame was grabbed
             
-            self.landmarks_data.append(landmark_row)
+        Returns:
+            tuple: (target_x, target_y) in pixels, or None if no dot was shown
+        """
+        # Results arrive in capture order, so the match is almost always the last dot
+        for onset, offset, target_x, target_y in reversed(self.dot_segments):
+            if capture_time >= onset:
+                if offset is None or capture_time < offset:
+                    return target_x, target_y
+                return None
+        return None
         
     def paintEvent(self, event):
         """Handle painting of the dot."""
         super().paintEvent(event)
+        self.paint_dot()
         
+        # Log when a dot change actually reached the screen buffer
+        if self.paint_event_pending is not None:
+            self.log_event(self.paint_event_pending)
+            self.paint_event_pending = None
+            
+    def paint_dot(self):
+        """Draw the current dot, if any."""
         if self.current_dot_position is None:
             return
             
@@ -242,20 +430,21 @@ Click OK when you're ready to begin.""")
     def finish_experiment(self):
         """Save data and clean up."""
         self.status_label.setText("Saving data...")
+        self.scheduler.stop()
+        logging.info(f"Stimulus timing relative to schedule: {self.scheduler.get_report()}")
         
         try:
-            # Create header row
-            header = ["timestamp", "target_x", "target_y"]
-            for i in range(468):  # MediaPipe face mesh has 468 landmarks
-                header.extend([f"landmark_{i}_x", f"landmark_{i}_y", f"landmark_{i}_z"])
-            
-            # Save landmarks data
-            self.data_manager.save_landmark_data(
-                self.trial_dir,
-                self.landmarks_data,
-                header
-            )
+            # Collect the last queued results, then stop capturing and flush
+            # the streamed landmarks data
+            self.process_frame()
+            self.log_state_usage()
+            self.stop_capture()
+            self.close_landmark_writer("completed")
             
+            if self.frames_dropped:
+                QMessageBox.warning(self, "Warning",
+                                    f"{self.frames_dropped} landmark frames were dropped because "
+                                    f"the disk could not keep up; the trial data has gaps.")
             QMessageBox.information(self, "Success", 
                                   "Experiment completed successfully!")
             self.finished.emit()
@@ -273,12 +462,15 @@ Click OK when you're ready to begin.""")
             
     def closeEvent(self, event):
         """Clean up resources when window is closed."""
-        if self.camera is not None:
-            self.camera.release()
-        if self.mp_face_mesh is not None:
-            self.mp_face_mesh.close()
-        if hasattr(self, 'capture_timer'):
-            self.capture_timer.stop()
+        self.scheduler.stop()
+        self.process_frame()
+        self.stop_capture()
+        try:
+            # Finalize whatever was recorded if the trial was aborted
+            self.close_landmark_writer()
+        except Exception as e:
+            QMessageBox.critical(self, "Error", 
+                               f"Failed to save experiment data: {str(e)}")
         event.accept()
 
 
@@ -6,11 +6,12 @@ from PyQt5.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
                            QHBoxLayout, QPushButton, QLabel, QLineEdit, 
                            QComboBox, QFileDialog, QMessageBox, QGroupBox, 
                            QFormLayout, QGridLayout)
-from PyQt5.QtCore import QTimer, Qt
+from PyQt5.QtCore import Qt
 from PyQt5.QtGui import QImage, QPixmap
 import cv2
-import mediapipe as mp
 import numpy as np
+from capture_engine import CaptureEngine
+from landmark_formats import LandmarkSchema
 
 class GazeEstimationApp(QMainWindow):
     def __init__(self):
@@ -128,33 +129,24 @@ class GazeEstimationApp(QMainWindow):
         self.layout.addLayout(main_layout)
 
     def setup_camera(self):
-        self.cap = cv2.VideoCapture(0)
-        self.timer = QTimer(self)
-        self.timer.timeout.connect(self.update_frame)
-        self.timer.start(30)  # Update every 30 ms
-
-        self.mp_face_mesh = mp.solutions.face_mesh
-        self.face_mesh = self.mp_face_mesh.FaceMesh(
-            max_num_faces=1,
-            refine_landmarks=True,
-            min_detection_confidence=0.5,
-            min_tracking_confidence=0.5
-        )
+        # Flip the frames horizontally for a more natural mirror view
+        self.capture_engine = CaptureEngine(flip=True, keep_frames=True)
+        self.capture_engine.results_ready.connect(self.update_frame)
+        self.capture_engine.start()
 
     def update_frame(self):
-        ret, frame = self.cap.read()
-        if ret:
-            # Flip the frame horizontally for a more natural mirror view
-            frame = cv2.flip(frame, 1)
-            
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-            results = self.face_mesh.process(rgb_frame)
-
-            if results.multi_face_landmarks:
-                for face_landmarks in results.multi_face_landmarks:
-                    self.draw_landmarks(frame, face_landmarks)
-                    if self.recording:
-                        self.record_landmarks(face_landmarks)
+        results = self.capture_engine.get_results()
+        if results:
+            # Record every result, but only display the newest frame
+            if self.recording:
+                for result in results:
+                    if result.landmarks is not None:
+                        self.record_landmarks(result.timestamp, result.landmarks)
+
+            result = results[-1]
+            frame = result.frame
+            if result.landmarks is not None:
+                self.draw_landmarks(frame, result.landmarks)
 
             height, width, channel = frame.shape
             bytes_per_line = 3 * width
@@ -169,8 +161,7 @@ class GazeEstimationApp(QMainWindow):
             y = int(landmark.y * frame.shape[0])
             cv2.circle(frame, (x, y), 1, (0, 255, 0), -1)
 
-    def record_landmarks(self, landmarks):
-        timestamp = datetime.now().timestamp()
+    def record_landmarks(self, timestamp, landmarks):
         landmark_row = [timestamp]
         for landmark in landmarks.landmark:
             landmark_row.extend([landmark.x, landmark.y, landmark.z])
@@ -215,6 +206,7 @@ class GazeEstimationApp(QMainWindow):
         self.save_data()
 
     def save_data(self):
+        camera_properties = self.capture_engine.camera_properties
         metadata = {
             "subject": {
                 "id": self.subject_id_input.text(),
@@ -233,8 +225,8 @@ class GazeEstimationApp(QMainWindow):
             "equipment": {
                 "webcam": {
                     "id": 0,  # Default camera
-                    "resolution": f"{int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))}x{int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))}",
-                    "fps": int(self.cap.get(cv2.CAP_PROP_FPS))
+                    "resolution": f"{camera_properties.get('width', 0)}x{camera_properties.get('height', 0)}",
+                    "fps": camera_properties.get('fps', 0)
                 }
             }
         }
@@ -248,11 +240,14 @@ class GazeEstimationApp(QMainWindow):
             with open(f"{directory}/{file_name}_metadata.json", "w") as f:
                 json.dump(metadata, f, indent=4)
 
-            # Save landmarks
-            with open(f"{directory}/{file_name}_landmarks.csv", "w", newline='') as f:
+            # Save landmarks; the header follows the recorded landmark count
+            num_landmarks = (len(self.landmarks_data[0]) - 1) // 3 if self.landmarks_data else None
+            schema = LandmarkSchema.get(num_landmarks, has_targets=False, has_timing=False)
+            landmarks_file = f"{directory}/{file_name}_landmarks.csv"
+            schema.write_sidecar(landmarks_file)
+            with open(landmarks_file, "w", newline='') as f:
                 writer = csv.writer(f)
-                writer.writerow(["timestamp"] + [f"landmark_{i}_{coord}" 
-                    for i in range(468) for coord in ['x','y','z']])
+                writer.writerow(schema.column_names)
                 writer.writerows(self.landmarks_data)
 
             QMessageBox.information(self, "Data Saved", 
@@ -267,7 +262,7 @@ class GazeEstimationApp(QMainWindow):
             if reply == QMessageBox.Yes:
                 self.stop_recording()
             
-        self.cap.release()
+        self.capture_engine.stop()
         event.accept()
 
 if __name__ == "__main__":
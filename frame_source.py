@@ -0,0 +1,259 @@
+import os
+import time
+import cv2
+import numpy as np
+
+# Selects the frame source for every window, e.g. "camera:1",
+# "video:/data/clip.avi,fps=0,loop=1" or "synthetic:fps=60,image=face.png"
+FRAME_SOURCE_ENV = "GAZE_FRAME_SOURCE"
+
+# Capture, inference and stimulus times all come from this monotonic,
+# high-resolution clock (seconds from an arbitrary origin)
+clock = time.perf_counter
+
+# Fixed offset from clock() to Unix time, taken once so converted times stay monotonic
+CLOCK_OFFSET = time.time() - clock()
+
+def clock_to_unix(t):
+    """Convert a clock() reading to seconds since the epoch."""
+    return t + CLOCK_OFFSET
+
+def unix_time():
+    """Current time in seconds since the epoch, on the monotonic capture clock."""
+    return clock_to_unix(clock())
+
+class FrameSource:
+    """Interface for everything that delivers BGR frames to the capture pipeline."""
+
+    def open(self):
+        """Open the source; returns True on success."""
+        raise NotImplementedError
+
+    def is_opened(self):
+        """Check if the source is open."""
+        raise NotImplementedError
+
+    def read(self):
+        """Return (ret, frame) like cv2.VideoCapture.read."""
+        raise NotImplementedError
+
+    def get_properties(self):
+        """Return the frame width, height and nominal fps."""
+        raise NotImplementedError
+
+    def get_timestamp(self):
+        """Backend timestamp of the last frame read in seconds, or None if unavailable."""
+        return None
+
+    def release(self):
+        """Close the source."""
+        raise NotImplementedError
+
+    def describe(self):
+        """Short human-readable description of the source."""
+        return type(self).__name__
+
+class CameraSource(FrameSource):
+    """Live camera through cv2.VideoCapture."""
+
+    def __init__(self, index=0):
+        self.index = index
+        self.capture = None
+
+    def open(self):
+        self.capture = cv2.VideoCapture(self.index)
+        return self.capture.isOpened()
+
+    def is_opened(self):
+        return self.capture is not None and self.capture.isOpened()
+
+    def read(self):
+        return self.capture.read()
+
+    def get_timestamp(self):
+        # Driver timestamp of the frame buffer; backends without one report 0 or -1
+        msec = self.capture.get(cv2.CAP_PROP_POS_MSEC)
+        return msec / 1000 if msec > 0 else None
+
+    def get_properties(self):
+        return {
+            "width": int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "height": int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            "fps": int(self.capture.get(cv2.CAP_PROP_FPS))
+        }
+
+    def release(self):
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None
+
+    def describe(self):
+        return f"camera {self.index}"
+
+class VideoFileSource(FrameSource):
+    """Recorded video file, replayed at a fixed rate or as fast as it decodes."""
+
+    def __init__(self, path, fps=None, loop=False):
+        """
+        Initialize the video file source.
+
+        Args:
+            path: Video file to read
+            fps: Replay rate; None uses the file's rate, 0 disables pacing
+            loop: Restart from the first frame at the end of the file
+        """
+        self.path = str(path)
+        self.fps = fps
+        self.loop = loop
+        self.capture = None
+        self._next_frame_time = None
+
+    def open(self):
+        self.capture = cv2.VideoCapture(self.path)
+        if self.fps is None:
+            self.fps = self.capture.get(cv2.CAP_PROP_FPS) or 30
+        self._next_frame_time = time.monotonic()
+        return self.capture.isOpened()
+
+    def is_opened(self):
+        return self.capture is not None and self.capture.isOpened()
+
+    def read(self):
+        if self.fps:
+            # Pace frames like a camera would deliver them
+            delay = self._next_frame_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._next_frame_time = max(self._next_frame_time, time.monotonic() - 1.0) + 1.0 / self.fps
+
+        ret, frame = self.capture.read()
+        if not ret and self.loop:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            ret, frame = self.capture.read()
+        return ret, frame
+
+    def get_timestamp(self):
+        # Position of the decoded frame in the file
+        return self.capture.get(cv2.CAP_PROP_POS_MSEC) / 1000
+
+    def get_properties(self):
+        return {
+            "width": int(self.capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+            "height": int(self.capture.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+            "fps": int(self.fps or self.capture.get(cv2.CAP_PROP_FPS))
+        }
+
+    def release(self):
+        if self.capture is not None:
+            self.capture.release()
+            self.capture = None
+
+    def describe(self):
+        return f"video {self.path}"
+
+class SyntheticSource(FrameSource):
+    """Generated frames at a configurable rate, for machines without a camera."""
+
+    def __init__(self, fps=30, width=1280, height=720, image=None, num_frames=None):
+        """
+        Initialize the synthetic source.
+
+        Args:
+            fps: Frame rate; 0 generates frames as fast as they are read
+            width: Frame width
+            height: Frame height
+            image: Optional image (e.g. a face photo) used as the frame background
+            num_frames: Stop after this many frames (None runs forever)
+        """
+        self.fps = fps
+        self.width = width
+        self.height = height
+        self.image = image
+        self.num_frames = num_frames
+        self.frames_generated = 0
+        self._background = None
+        self._next_frame_time = None
+
+    def open(self):
+        if self.image is not None:
+            background = cv2.imread(str(self.image))
+            if background is None:
+                return False
+            self._background = cv2.resize(background, (self.width, self.height))
+        else:
+            # Horizontal gray gradient
+            row = np.linspace(0, 255, self.width, dtype=np.uint8)
+            self._background = np.repeat(np.tile(row, (self.height, 1))[:, :, None], 3, axis=2)
+        self._next_frame_time = time.monotonic()
+        return True
+
+    def is_opened(self):
+        return self._background is not None
+
+    def read(self):
+        if self._background is None:
+            return False, None
+        if self.num_frames is not None and self.frames_generated >= self.num_frames:
+            return False, None
+
+        if self.fps:
+            delay = self._next_frame_time - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self._next_frame_time = max(self._next_frame_time, time.monotonic() - 1.0) + 1.0 / self.fps
+
+        # Moving marker so consecutive frames differ
+        frame = self._background.copy()
+        x = (self.frames_generated * 8) % self.width
+        cv2.circle(frame, (x, 20), 10, (0, 0, 255), -1)
+        self.frames_generated += 1
+        return True, frame
+
+    def get_properties(self):
+        return {"width": self.width, "height": self.height, "fps": int(self.fps)}
+
+    def release(self):
+        self._background = None
+
+    def describe(self):
+        return f"synthetic {self.width}x{self.height} @ {self.fps} fps"
+
+def create_frame_source(spec=None):
+    """
+    Create a frame source from a specification string.
+
+    Args:
+        spec: "camera[:index]", "video:<path>[,fps=N][,loop=1]" or
+              "synthetic[:fps=N,width=W,height=H,image=<path>,frames=N]";
+              defaults to the GAZE_FRAME_SOURCE environment variable, then camera 0
+
+    Returns:
+        FrameSource: Unopened frame source
+    """
+    if spec is None:
+        spec = os.environ.get(FRAME_SOURCE_ENV, "camera:0")
+    spec = str(spec)
+    if spec.isdigit():
+        return CameraSource(int(spec))
+
+    kind, _, rest = spec.partition(":")
+    arguments = [part for part in rest.split(",") if part] if rest else []
+    positional = [part for part in arguments if "=" not in part]
+    options = dict(part.split("=", 1) for part in arguments if "=" in part)
+
+    if kind == "camera":
+        return CameraSource(int(positional[0]) if positional else 0)
+    if kind == "video":
+        if not positional:
+            raise ValueError("Video frame source needs a file path")
+        fps = float(options["fps"]) if "fps" in options else None
+        return VideoFileSource(positional[0], fps=fps, loop=options.get("loop") == "1")
+    if kind == "synthetic":
+        return SyntheticSource(
+            fps=float(options.get("fps", 30)),
+            width=int(options.get("width", 1280)),
+            height=int(options.get("height", 720)),
+            image=options.get("image"),
+            num_frames=int(options["frames"]) if "frames" in options else None
+        )
+    raise ValueError(f"Unknown frame source: {spec}")
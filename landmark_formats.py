@@ -0,0 +1,447 @@
+import os
+import csv
+import json
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+from landmark_store import LandmarkStore, TIMING_FIELDS, face_mesh_landmark_count
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S.%f"
+
+# Version of the landmark file layout, recorded with every file written.
+# Version 1 files carry no version and may name only 468 landmarks in the CSV
+# header while holding 478; from version 2 on, the columns always match the data
+LANDMARK_SCHEMA_VERSION = 2
+
+class LandmarkSchema:
+    """
+    Column layout of a landmark file, shared by every writer.
+
+    Schemas are cached per layout, so the 1,400+ column names are built once
+    per process; obtain them with LandmarkSchema.get() or for_store().
+    """
+    _cache = {}
+
+    def __init__(self, landmark_indices, has_targets=True, has_timing=True):
+        """
+        Build the column layout.
+
+        Args:
+            landmark_indices: Tuple of the FaceMesh indices of the stored landmarks
+            has_targets: Whether target_x and target_y follow the timestamp
+            has_timing: Whether the TIMING_FIELDS columns end each row
+        """
+        self.landmark_indices = landmark_indices
+        self.num_landmarks = len(landmark_indices)
+        self.has_targets = has_targets
+        self.has_timing = has_timing
+        self.is_subset = landmark_indices != tuple(range(self.num_landmarks))
+        self._indices = np.array(landmark_indices, dtype=np.intp)
+
+        column_names = ["timestamp"]
+        if has_targets:
+            column_names.extend(["target_x", "target_y"])
+        for i in landmark_indices:
+            column_names.extend([f"landmark_{i}_x", f"landmark_{i}_y", f"landmark_{i}_z"])
+        if has_timing:
+            column_names.extend(TIMING_FIELDS)
+        self.column_names = tuple(column_names)
+
+    @classmethod
+    def get(cls, num_landmarks=None, landmark_indices=None, has_targets=True, has_timing=True):
+        """
+        Return the cached schema for a layout.
+
+        Args:
+            num_landmarks: Landmarks produced by the model (default: live capture setting)
+            landmark_indices: Optional subset of FaceMesh indices that is stored
+            has_targets: Whether the file has target columns
+            has_timing: Whether the file has timing columns
+        """
+        if landmark_indices is None:
+            if num_landmarks is None:
+                num_landmarks = face_mesh_landmark_count()
+            landmark_indices = tuple(range(num_landmarks))
+        else:
+            landmark_indices = tuple(int(i) for i in landmark_indices)
+
+        key = (landmark_indices, has_targets, has_timing)
+        schema = cls._cache.get(key)
+        if schema is None:
+            schema = cls._cache[key] = cls(landmark_indices, has_targets, has_timing)
+        return schema
+
+    @classmethod
+    def for_store(cls, store):
+        """Return the schema of the landmarks held by a LandmarkStore."""
+        return cls.get(store.num_landmarks, store.landmark_indices)
+
+    def create_store(self, chunk_size=1024):
+        """Create an empty LandmarkStore that keeps this schema's landmarks."""
+        return LandmarkStore(self.num_landmarks, chunk_size=chunk_size,
+                             landmark_indices=self._indices if self.is_subset else None)
+
+    def check_store(self, store):
+        """Raise ValueError if a store's landmarks do not match the columns."""
+        if store.num_landmarks != self.num_landmarks or \
+                not np.array_equal(store.get_landmark_indices(), self._indices):
+            raise ValueError(f"Landmarks do not match the file columns: {store.num_landmarks} "
+                             f"landmarks for {self.num_landmarks} columns")
+
+    def to_metadata(self):
+        """Describe the layout for the file metadata."""
+        return {
+            "version": LANDMARK_SCHEMA_VERSION,
+            "num_landmarks": self.num_landmarks,
+            "landmark_indices": list(self.landmark_indices) if self.is_subset else None,
+            "has_targets": self.has_targets,
+            "has_timing": self.has_timing
+        }
+
+    def write_sidecar(self, csv_path):
+        """Write the layout next to a CSV file, which has no room for metadata."""
+        with open(schema_sidecar_path(csv_path), 'w') as f:
+            json.dump(self.to_metadata(), f, indent=2)
+
+def schema_sidecar_path(csv_path):
+    """Return the path of the schema file written next to a landmark CSV file."""
+    return Path(csv_path).with_suffix(".schema.json")
+
+def store_to_rows(store, batch_size=100):
+    """
+    Yield CSV rows (timestamp, target_x, target_y, landmark coordinates, timing) from a LandmarkStore.
+
+    Args:
+        store: LandmarkStore with the frames to convert
+        batch_size: Number of frames formatted per NumPy pass
+    """
+    for start in range(0, len(store), batch_size):
+        stop = min(start + batch_size, len(store))
+        values = np.hstack([
+            store.targets[start:stop],
+            store.landmarks[start:stop].reshape(stop - start, -1)
+        ])
+        # Shortest float32 representation, without float64 rounding noise
+        text = values.astype(str)
+        timing = store.timing[start:stop].astype(str)
+        for timestamp, row, frame_timing in zip(store.timestamps[start:stop], text, timing):
+            timestamp = datetime.fromtimestamp(timestamp).strftime(TIMESTAMP_FORMAT)
+            yield [timestamp] + row.tolist() + frame_timing.tolist()
+
+class CsvLandmarkFormat:
+    """Text output: one CSV row per frame, written as batches arrive."""
+    filename = "landmark_data.csv"
+
+    def __init__(self, path, schema, metadata):
+        self.path = path
+        self.schema = schema
+        schema.write_sidecar(path)
+        self._file = open(path, 'w', newline='')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(schema.column_names)
+        self._file.flush()
+
+    def write_batch(self, store):
+        """Append the frames in the store."""
+        self.schema.check_store(store)
+        self._writer.writerows(store_to_rows(store))
+        self._file.flush()
+
+    def close(self):
+        """Close the file."""
+        self._file.close()
+
+class NpzLandmarkFormat:
+    """Compressed binary output: float32 arrays plus JSON metadata in a single .npz file."""
+    filename = "landmark_data.npz"
+
+    def __init__(self, path, schema, metadata):
+        """Open the output; without a schema it is taken from the first batch."""
+        self.path = path
+        self.schema = schema
+        self.metadata = metadata
+        self._store = None
+
+    def write_batch(self, store):
+        """Collect the frames in the store; the archive is written on close."""
+        if self.schema is None:
+            self.schema = LandmarkSchema.for_store(store)
+        self.schema.check_store(store)
+        if self._store is None:
+            self._store = self.schema.create_store()
+        self._store.extend(store)
+
+    def close(self):
+        """Write the compressed archive."""
+        store = self._store
+        if store is None:
+            store = (self.schema or LandmarkSchema.get()).create_store(chunk_size=1)
+        np.savez_compressed(
+            self.path,
+            timestamps=store.get_timestamps(),
+            targets=store.get_targets(),
+            landmarks=store.get_landmarks(),
+            timing=store.get_timing(),
+            landmark_indices=store.get_landmark_indices(),
+            schema_version=np.array(LANDMARK_SCHEMA_VERSION),
+            metadata=np.array(json.dumps(self.metadata))
+        )
+
+class ParquetLandmarkFormat:
+    """Columnar output: one float32 column per coordinate, in row groups of row_group_size frames."""
+    filename = "landmark_data.parquet"
+    # Small row groups repeat the per-column overhead of ~1,400 columns and
+    # compress poorly; a live trial flushes about 30 frames at a time
+    row_group_size = 1024
+
+    def __init__(self, path, schema, metadata):
+        try:
+            import pyarrow as pa
+            import pyarrow.parquet as pq
+        except ImportError:
+            raise ImportError("Parquet output requires pyarrow (pip install pyarrow)")
+
+        self.path = path
+        self.schema = schema
+        self.metadata = metadata
+        self._pa = pa
+        self._pq = pq
+        self._writer = None
+        self._store = None
+
+    def _open(self):
+        """Create the writer with one column per schema column."""
+        pa = self._pa
+        fields = [
+            pa.field(name, pa.float64() if name == "timestamp" or name in TIMING_FIELDS else pa.float32())
+            for name in self.schema.column_names
+        ]
+        schema = pa.schema(fields, metadata={
+            "metadata": json.dumps(self.metadata),
+            "landmark_schema": json.dumps(self.schema.to_metadata())
+        })
+        self._writer = self._pq.ParquetWriter(str(self.path), schema, compression='zstd')
+
+    def write_batch(self, store):
+        """Collect the frames in the store, writing a row group once row_group_size are buffered."""
+        if self.schema is None:
+            self.schema = LandmarkSchema.for_store(store)
+        self.schema.check_store(store)
+        if self._store is None:
+            self._store = self.schema.create_store(chunk_size=self.row_group_size)
+        self._store.extend(store)
+        if len(self._store) >= self.row_group_size:
+            self._write_row_group()
+
+    def _write_row_group(self):
+        """Write the buffered frames as one row group."""
+        if self._writer is None:
+            self._open()
+        store = self._store
+        if not len(store):
+            return
+
+        landmarks = store.get_landmarks().reshape(len(store), -1)
+        targets = store.get_targets()
+        columns = [store.get_timestamps().copy(), targets[:, 0].copy(), targets[:, 1].copy()]
+        columns.extend(landmarks[:, i].copy() for i in range(landmarks.shape[1]))
+        timing = store.get_timing()
+        columns.extend(timing[:, i].copy() for i in range(len(TIMING_FIELDS)))
+        self._writer.write_batch(self._pa.record_batch(columns, schema=self._writer.schema))
+        store.clear()
+
+    def close(self):
+        """Write the remaining frames as a last row group and the file footer."""
+        if self.schema is None:
+            self.schema = LandmarkSchema.get()
+        if self._store is not None:
+            self._write_row_group()
+        if self._writer is None:
+            self._open()
+        self._writer.close()
+
+LANDMARK_FORMATS = {
+    "csv": CsvLandmarkFormat,
+    "npz": NpzLandmarkFormat,
+    "parquet": ParquetLandmarkFormat
+}
+
+def open_landmark_outputs(directory, schema, metadata, output_formats):
+    """
+    Open one writer per landmark output format.
+
+    Args:
+        directory: Directory the files are written to
+        schema: LandmarkSchema of the outputs
+        metadata: Dictionary embedded in the binary outputs
+        output_formats: Names from LANDMARK_FORMATS
+
+    Returns:
+        list: Opened writers; none are left open if one fails
+    """
+    outputs = []
+    try:
+        for name in output_formats:
+            output_format = LANDMARK_FORMATS[name]
+            outputs.append(output_format(directory / output_format.filename, schema, metadata))
+        return outputs
+    except Exception:
+        for output in outputs:
+            output.close()
+        raise
+
+def save_landmark_store(directory, store, output_formats, schema=None, metadata=None):
+    """
+    Write a complete LandmarkStore in every given output format.
+
+    Args:
+        directory: Directory the files are written to
+        store: LandmarkStore holding the frames
+        output_formats: Names from LANDMARK_FORMATS
+        schema: LandmarkSchema of the outputs (default: that of the store)
+        metadata: Dictionary embedded in the binary outputs
+
+    Returns:
+        list: Paths of the written files
+    """
+    if schema is None:
+        schema = LandmarkSchema.for_store(store)
+    outputs = open_landmark_outputs(directory, schema, metadata or {}, output_formats)
+    try:
+        for output in outputs:
+            output.write_batch(store)
+    finally:
+        for output in outputs:
+            output.close()
+    return [output.path for output in outputs]
+
+# Selects the landmark files written for every trial of a session, e.g. "csv,parquet"
+OUTPUT_FORMATS_ENV = "GAZE_OUTPUT_FORMATS"
+
+def get_output_formats(spec=None, default=("csv", "npz")):
+    """
+    Parse a comma-separated list of landmark output formats.
+
+    Args:
+        spec: Format names such as "csv,npz"; defaults to the GAZE_OUTPUT_FORMATS
+              environment variable
+        default: Formats used when neither is set
+
+    Returns:
+        tuple: Format names, validated by DataManager
+    """
+    if spec is None:
+        spec = os.environ.get(OUTPUT_FORMATS_ENV)
+    if not spec:
+        return tuple(default)
+    return tuple(name.strip().lower() for name in spec.split(",") if name.strip())
+
+def parse_timestamp(value):
+    """Parse a CSV timestamp written either as seconds or as a formatted date."""
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.strptime(value, TIMESTAMP_FORMAT).timestamp()
+
+def read_landmark_csv(path):
+    """
+    Read a landmark CSV file into a LandmarkStore.
+
+    Handles both the experiment layout (timestamp, target_x, target_y, landmarks)
+    and the standalone collector layout (timestamp, landmarks), with or without
+    the trailing timing columns. Versioned files are described by their schema
+    file; for older ones the number of landmarks is taken from the data rather
+    than the header, and landmark subsets are recognized from the column names.
+    """
+    schema = read_csv_schema(path)
+    store = None
+    with open(path, newline='') as f:
+        reader = csv.reader(f)
+        header = next(reader, [])
+        has_targets = len(header) > 2 and header[1] == "target_x"
+        has_timing = tuple(header[-len(TIMING_FIELDS):]) == TIMING_FIELDS
+        first_value = 3 if has_targets else 1
+        last_value = -len(TIMING_FIELDS) if has_timing else None
+        landmark_indices = None
+        if schema is not None:
+            landmark_indices = schema["landmark_indices"]
+        else:
+            try:
+                landmark_indices = [int(name.split("_")[1]) for name in header[first_value:last_value:3]]
+            except (IndexError, ValueError):
+                pass
+        
+        for row in reader:
+            if not row:
+                continue
+            values = np.array(row[first_value:last_value], dtype=np.float32).reshape(-1, 3)
+            if store is None:
+                # Headers that do not match the data (such as 468 names for 478 landmarks) are ignored
+                if landmark_indices is not None and (len(landmark_indices) != len(values) or
+                                                     landmark_indices == list(range(len(values)))):
+                    landmark_indices = None
+                store = LandmarkStore(len(values), landmark_indices=landmark_indices)
+            target_x, target_y = (float(row[1]), float(row[2])) if has_targets else (np.nan, np.nan)
+            timing = [float(value) for value in row[last_value:]] if has_timing else None
+            store.append(parse_timestamp(row[0]), target_x, target_y, values, timing)
+    
+    return store if store is not None else LandmarkStore(chunk_size=1)
+
+def read_csv_schema(path):
+    """Return the schema description written next to a landmark CSV file, or None for older files."""
+    try:
+        with open(schema_sidecar_path(path)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+
+def read_landmark_schema_version(path):
+    """
+    Return the LANDMARK_SCHEMA_VERSION a landmark file was written with.
+
+    Files written before the layout was versioned report version 1.
+    """
+    path = Path(path)
+    if path.suffix == ".npz":
+        with np.load(path) as archive:
+            return int(archive['schema_version']) if 'schema_version' in archive.files else 1
+    if path.suffix == ".parquet":
+        import pyarrow.parquet as pq
+        metadata = pq.read_schema(path).metadata or {}
+        schema = metadata.get(b"landmark_schema")
+        return json.loads(schema)["version"] if schema else 1
+    schema = read_csv_schema(path)
+    return schema["version"] if schema is not None else 1
+
+def read_landmark_npz(path):
+    """Read a landmark .npz archive into a LandmarkStore."""
+    with np.load(path) as archive:
+        landmarks = archive['landmarks']
+        landmark_indices = None
+        if 'landmark_indices' in archive.files and \
+                not np.array_equal(archive['landmark_indices'], np.arange(landmarks.shape[1])):
+            landmark_indices = archive['landmark_indices']
+        store = LandmarkStore(landmarks.shape[1], chunk_size=max(len(landmarks), 1),
+                              landmark_indices=landmark_indices)
+        store.landmarks[:len(landmarks)] = landmarks
+        store.timestamps[:len(landmarks)] = archive['timestamps']
+        store.targets[:len(landmarks)] = archive['targets']
+        # Archives written before timing was recorded have no timing array
+        store.timing[:len(landmarks)] = archive['timing'] if 'timing' in archive.files else np.nan
+        store.count = len(landmarks)
+    return store
+
+def read_trial_landmarks(trial_dir):
+    """
+    Read a trial's landmarks, preferring the binary output over the CSV.
+
+    Returns:
+        LandmarkStore, or None if the trial has no landmark file
+    """
+    npz_file = trial_dir / NpzLandmarkFormat.filename
+    if npz_file.exists():
+        return read_landmark_npz(npz_file)
+    csv_file = trial_dir / CsvLandmarkFormat.filename
+    if csv_file.exists():
+        return read_landmark_csv(csv_file)
+    return None
@@ -0,0 +1,242 @@
+import numpy as np
+
+# Per-frame timing columns, all in seconds; NaN where a value is not available.
+# capture_time, inference_start and inference_end are monotonic clock readings,
+# camera_time is the capture backend's own frame timestamp
+TIMING_FIELDS = ("capture_time", "camera_time", "inference_start", "inference_end")
+
+# FaceMesh iris refinement used for live capture
+REFINE_LANDMARKS = True
+
+def face_mesh_landmark_count(refine_landmarks=REFINE_LANDMARKS):
+    """Return the landmarks per face FaceMesh produces; refinement adds 10 iris points."""
+    return 478 if refine_landmarks else 468
+
+# Wire layout of a NormalizedLandmark entry that only has x, y and z set:
+# field tag + length of the entry, then a tag byte before each little-endian float32
+LANDMARK_RECORD = np.dtype([
+    ('entry_tag', 'u1'), ('entry_length', 'u1'),
+    ('x_tag', 'u1'), ('x', '<f4'),
+    ('y_tag', 'u1'), ('y', '<f4'),
+    ('z_tag', 'u1'), ('z', '<f4')
+])
+LANDMARK_RECORD_TAGS = {
+    'entry_tag': 0x0a,
+    'entry_length': LANDMARK_RECORD.itemsize - 2,
+    'x_tag': 0x0d,
+    'y_tag': 0x15,
+    'z_tag': 0x1d
+}
+
+def landmarks_to_array(landmarks, out=None):
+    """
+    Convert a MediaPipe landmark list to a (num_landmarks, 3) float32 array.
+
+    The serialized protobuf is decoded in one NumPy pass when every landmark
+    only carries x, y and z (the FaceMesh case); anything else falls back to
+    reading the landmark attributes one by one.
+
+    Args:
+        landmarks: MediaPipe NormalizedLandmarkList
+        out: Optional preallocated (num_landmarks, 3) float32 array to fill
+
+    Returns:
+        numpy.ndarray: Landmark coordinates
+    """
+    points = landmarks.landmark
+    if out is None:
+        out = np.empty((len(points), 3), dtype=np.float32)
+
+    buffer = landmarks.SerializeToString()
+    if len(buffer) == len(points) * LANDMARK_RECORD.itemsize:
+        records = np.frombuffer(buffer, dtype=LANDMARK_RECORD)
+        if all((records[field] == tag).all() for field, tag in LANDMARK_RECORD_TAGS.items()):
+            out[:, 0] = records['x']
+            out[:, 1] = records['y']
+            out[:, 2] = records['z']
+            return out
+
+    out[:] = [(point.x, point.y, point.z) for point in points]
+    return out
+
+class LandmarkStore:
+    """Compact landmark frame store backed by preallocated arrays that grow in chunks."""
+
+    def __init__(self, num_landmarks=478, chunk_size=1024, landmark_indices=None):
+        """
+        Initialize the landmark store.
+
+        Args:
+            num_landmarks: Landmarks per frame (478 with refined iris landmarks)
+            chunk_size: Number of frames allocated at once
+            landmark_indices: Optional FaceMesh indices to keep from every appended
+                              landmark list (see landmark_subsets); num_landmarks
+                              is then the number of indices
+        """
+        if landmark_indices is not None:
+            landmark_indices = np.asarray(landmark_indices, dtype=np.intp)
+            num_landmarks = len(landmark_indices)
+        self.num_landmarks = num_landmarks
+        self.landmark_indices = landmark_indices
+        self._decoded = None
+        self.chunk_size = chunk_size
+        self.count = 0
+        self.landmarks = np.empty((chunk_size, num_landmarks, 3), dtype=np.float32)
+        self.timestamps = np.empty(chunk_size, dtype=np.float64)
+        self.targets = np.empty((chunk_size, 2), dtype=np.float32)
+        self.timing = np.empty((chunk_size, len(TIMING_FIELDS)), dtype=np.float64)
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def capacity(self):
+        """Number of frames that fit without growing."""
+        return len(self.timestamps)
+
+    @property
+    def nbytes(self):
+        """Memory held by the backing arrays in bytes."""
+        return self.landmarks.nbytes + self.timestamps.nbytes + self.targets.nbytes + self.timing.nbytes
+
+    def _grow(self):
+        """Extend the backing arrays by one chunk."""
+        capacity = self.capacity + self.chunk_size
+        for name in ('landmarks', 'timestamps', 'targets', 'timing'):
+            old = getattr(self, name)
+            new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self.count] = old[:self.count]
+            setattr(self, name, new)
+
+    def append(self, timestamp, target_x, target_y, landmarks, timing=None):
+        """
+        Add a frame to the store.
+
+        Args:
+            timestamp: Frame time in seconds
+            target_x: Horizontal target position
+            target_y: Vertical target position
+            landmarks: MediaPipe NormalizedLandmarkList, reduced to landmark_indices
+                       if set, or (num_landmarks, 3) array of already selected landmarks
+            timing: Optional values for TIMING_FIELDS (None entries are stored as NaN)
+        """
+        indices = self.landmark_indices
+        if hasattr(landmarks, 'landmark') and indices is not None:
+            if len(landmarks.landmark) <= indices[-1]:
+                raise ValueError(f"Landmark subset needs {indices[-1] + 1} landmarks, "
+                                 f"got {len(landmarks.landmark)}")
+        elif hasattr(landmarks, 'landmark'):
+            if len(landmarks.landmark) != self.num_landmarks:
+                raise ValueError(f"Expected {self.num_landmarks} landmarks, "
+                                 f"got {len(landmarks.landmark)}")
+        elif np.shape(landmarks) != (self.num_landmarks, 3):
+            raise ValueError(f"Expected landmarks of shape ({self.num_landmarks}, 3), "
+                             f"got {np.shape(landmarks)}")
+
+        if self.count == self.capacity:
+            self._grow()
+
+        index = self.count
+        if hasattr(landmarks, 'landmark') and indices is not None:
+            # Decode the full list into a reused buffer and keep only the subset
+            if self._decoded is None or len(self._decoded) != len(landmarks.landmark):
+                self._decoded = np.empty((len(landmarks.landmark), 3), dtype=np.float32)
+            landmarks_to_array(landmarks, out=self._decoded)
+            np.take(self._decoded, indices, axis=0, out=self.landmarks[index])
+        elif hasattr(landmarks, 'landmark'):
+            landmarks_to_array(landmarks, out=self.landmarks[index])
+        else:
+            self.landmarks[index] = landmarks
+        self.timestamps[index] = timestamp
+        self.targets[index] = (target_x, target_y)
+        if timing is None:
+            self.timing[index] = np.nan
+        else:
+            self.timing[index] = [np.nan if value is None else value for value in timing]
+        self.count += 1
+
+    def extend(self, other):
+        """Append all frames of another store with the same landmarks."""
+        if other.num_landmarks != self.num_landmarks:
+            raise ValueError(f"Expected {self.num_landmarks} landmarks, "
+                             f"got {other.num_landmarks}")
+        if not np.array_equal(other.get_landmark_indices(), self.get_landmark_indices()):
+            raise ValueError("Cannot combine stores with different landmark subsets")
+        count = len(other)
+        while self.count + count > self.capacity:
+            self._grow()
+
+        end = self.count + count
+        self.landmarks[self.count:end] = other.get_landmarks()
+        self.timestamps[self.count:end] = other.get_timestamps()
+        self.targets[self.count:end] = other.get_targets()
+        self.timing[self.count:end] = other.get_timing()
+        self.count = end
+
+    def get_landmark_indices(self):
+        """Return the FaceMesh index of every stored landmark."""
+        if self.landmark_indices is None:
+            return np.arange(self.num_landmarks)
+        return self.landmark_indices
+
+    def get_landmarks(self):
+        """Return a (count, num_landmarks, 3) view of the stored landmarks."""
+        return self.landmarks[:self.count]
+
+    def get_timestamps(self):
+        """Return a view of the stored timestamps."""
+        return self.timestamps[:self.count]
+
+    def get_targets(self):
+        """Return a (count, 2) view of the stored target positions."""
+        return self.targets[:self.count]
+
+    def get_timing(self):
+        """Return a (count, len(TIMING_FIELDS)) view of the stored frame timing."""
+        return self.timing[:self.count]
+
+    def clear(self):
+        """Remove all frames but keep the allocated memory for reuse."""
+        self.count = 0
+
+def main():
+    """Compare per-frame cost and memory of list rows against the landmark store."""
+    import time
+    import tracemalloc
+    from mediapipe.framework.formats import landmark_pb2
+
+    num_frames = 1800  # One minute at 30 fps
+    landmarks = landmark_pb2.NormalizedLandmarkList()
+    for i in range(478):
+        point = landmarks.landmark.add()
+        point.x, point.y, point.z = i / 478, 0.5, -0.01
+
+    # Per-row Python lists, as built by the original process_frame
+    tracemalloc.start()
+    start = time.perf_counter()
+    rows = []
+    for i in range(num_frames):
+        row = [float(i), 100.0, 200.0]
+        for landmark in landmarks.landmark:
+            row.extend([landmark.x, landmark.y, landmark.z])
+        rows.append(row)
+    list_time = (time.perf_counter() - start) / num_frames
+    list_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del rows
+
+    # Preallocated landmark store
+    tracemalloc.start()
+    start = time.perf_counter()
+    store = LandmarkStore()
+    for i in range(num_frames):
+        store.append(float(i), 100.0, 200.0, landmarks)
+    store_time = (time.perf_counter() - start) / num_frames
+    store_memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+
+    print(f"List rows:      {list_time * 1e6:8.1f} us/frame, {list_memory / 1e6:8.1f} MB")
+    print(f"Landmark store: {store_time * 1e6:8.1f} us/frame, {store_memory / 1e6:8.1f} MB")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,48 @@
+import numpy as np
+
+# FaceMesh indices; left and right are from the subject's point of view
+EYE_CORNERS = (33, 133, 362, 263)
+RIGHT_EYE = (33, 7, 163, 144, 145, 153, 154, 155, 133, 173, 157, 158, 159, 160, 161, 246)
+LEFT_EYE = (362, 382, 381, 380, 374, 373, 390, 249, 263, 466, 388, 387, 386, 385, 384, 398)
+# Iris centers are 468 (right) and 473 (left), each followed by four boundary points
+IRISES = tuple(range(468, 478))
+# Rigid points for head pose: forehead, nose bridge, nose tip, chin, cheeks, mouth corners
+POSE_ANCHORS = (10, 168, 1, 152, 234, 454, 61, 291)
+
+# Named subsets selectable with trial_config['landmark_subset']; None keeps every landmark
+LANDMARK_SUBSETS = {
+    "full": None,
+    "eyes_iris": tuple(sorted(RIGHT_EYE + LEFT_EYE + IRISES)),
+    "eyes_iris_pose": tuple(sorted(RIGHT_EYE + LEFT_EYE + IRISES + POSE_ANCHORS))
+}
+
+def resolve_landmark_subset(subset, num_landmarks=478):
+    """
+    Turn a landmark subset selection into the indices to keep.
+
+    Args:
+        subset: Name from LANDMARK_SUBSETS, a list of FaceMesh indices, or None
+                for all landmarks
+        num_landmarks: Landmarks produced by the model
+
+    Returns:
+        numpy.ndarray: Sorted landmark indices, or None to keep all landmarks
+    """
+    if subset is None:
+        return None
+    if isinstance(subset, str):
+        if subset not in LANDMARK_SUBSETS:
+            raise ValueError(f"Unknown landmark subset: {subset} "
+                             f"(expected one of {sorted(LANDMARK_SUBSETS)} or a list of indices)")
+        subset = LANDMARK_SUBSETS[subset]
+        if subset is None:
+            return None
+
+    indices = np.unique(np.asarray(subset, dtype=np.intp))
+    if len(indices) == 0:
+        raise ValueError("Landmark subset is empty")
+    if indices[0] < 0 or indices[-1] >= num_landmarks:
+        raise ValueError(f"Landmark subset indices must be between 0 and {num_landmarks - 1}")
+    if len(indices) == num_landmarks:
+        return None
+    return indices
@@ -1,14 +1,86 @@
+import time
+# Reference point for the startup-time measurement, taken before any heavy import
+STARTUP_TIME = time.perf_counter()
+
 import sys
+import os
+import logging
+import importlib
+import importlib.util
+import threading
 from PyQt5.QtWidgets import QApplication
+from PyQt5.QtCore import QObject, QEvent
 from data_manager import DataManager
-import os
+from landmark_formats import get_output_formats
+from capture_session import CaptureSession
+
+# Imported in the background while the consent and metadata forms are shown
+PRELOAD_MODULES = ("cv2", "mediapipe", "capture_engine", "setup_window")
+
+class ModulePreloader(threading.Thread):
+    """Background thread that imports the heavy modules before the setup window needs them."""
+    
+    def __init__(self, module_names, report=False):
+        """
+        Initialize the preloader.
+        
+        Args:
+            module_names: Modules to import, in order
+            report: Print the import times when done
+        """
+        super().__init__(daemon=True)
+        self.module_names = module_names
+        self.report = report
+        self.import_times = {}
+    
+    def run(self):
+        """Import the modules; failures are logged and reported again on first real use."""
+        for name in self.module_names:
+            start = time.perf_counter()
+            try:
+                importlib.import_module(name)
+            except Exception as e:
+                logging.error(f"Error preloading {name}: {str(e)}")
+                continue
+            self.import_times[name] = time.perf_counter() - start
+        
+        if self.report:
+            elapsed = time.perf_counter() - STARTUP_TIME
+            details = ", ".join(f"{name} {seconds * 1000:.0f} ms" for name, seconds in self.import_times.items())
+            print(f"Background imports ready after {elapsed * 1000:.0f} ms ({details})")
+
+class StartupTimer(QObject):
+    """Event filter that reports the time from process start to the first visible window."""
+    
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.first_window_time = None
+    
+    def eventFilter(self, obj, event):
+        if event.type() == QEvent.Show and obj.isWidgetType() and obj.isWindow():
+            self.first_window_time = time.perf_counter() - STARTUP_TIME
+            print(f"Time to first window: {self.first_window_time * 1000:.0f} ms ({type(obj).__name__})")
+            QApplication.instance().removeEventFilter(self)
+        return False
+
 class GazeEstimationApp:
     """Main application class for the gaze estimation experiment."""
     
-    def __init__(self):
-        """Initialize the application."""
+    def __init__(self, measure_startup=False, roi_tracking=False):
+        """
+        Initialize the application.
+        
+        Args:
+            measure_startup: Print the time to the first window and to the end
+                             of the background imports
+            roi_tracking: Run FaceMesh on a crop around the tracked face
+        """
         # Create QApplication first
         self.app = QApplication(sys.argv)
+        self.startup_timer = None
+        if measure_startup:
+            self.startup_timer = StartupTimer()
+            self.app.installEventFilter(self.startup_timer)
         
         # Set application properties
         self.app.setStyle('Fusion')
@@ -53,35 +125,48 @@ class GazeEstimationApp:
             }}
         """)        
         
-        # Create data manager with application instance
-        self.data_manager = DataManager(app_version='1.0.3')
+        # Create data manager with application instance; by default landmarks are
+        # also written as compressed float32 arrays for model training, and
+        # GAZE_OUTPUT_FORMATS selects other formats for the session
+        self.data_manager = DataManager(app_version='1.0.3', output_formats=get_output_formats())
+        
+        # One camera and FaceMesh pipeline for the whole session; the setup and
+        # experiment windows subscribe to it instead of reopening the camera
+        self.capture_session = CaptureSession(roi_tracking=roi_tracking)
+        
+        # OpenCV and MediaPipe load while the user reads the consent form
+        self.preloader = ModulePreloader(PRELOAD_MODULES, report=measure_startup)
         
     def start(self):
         """Start the application with the metadata collection window."""
+        self.preloader.start()
         from metadata_window import MainWindow
-        self.main_window = MainWindow(self.data_manager)
+        self.main_window = MainWindow(self.data_manager, self.capture_session)
         self.main_window.show()
-        return self.app.exec_()
+        try:
+            return self.app.exec_()
+        finally:
+            self.capture_session.stop()
     
     @staticmethod
     def check_dependencies():
-        """Check if all required dependencies are installed."""
-        try:
-            import cv2
-            import mediapipe
-            import numpy as np
-            print("All dependencies are installed.")
-            return True
-        except ImportError as e:
-            print(f"Missing dependency: {str(e)}")
+        """Check if all required dependencies are installed, without importing them."""
+        missing = [name for name in ("cv2", "mediapipe", "numpy")
+                   if importlib.util.find_spec(name) is None]
+        if missing:
+            print(f"Missing dependency: {', '.join(missing)}")
             return False
+        print("All dependencies are installed.")
+        return True
 
 def main():
     os.environ['TF_CPP_MIN_LOG_LEVEL'] = '2'  # Suppress TensorFlow logging
 
     """Main entry point of the application."""
-    # Create application instance
-    app = GazeEstimationApp()
+    # Create application instance; --startup-time reports time to first window,
+    # --roi-tracking crops frames around the face before FaceMesh
+    app = GazeEstimationApp(measure_startup="--startup-time" in sys.argv,
+                            roi_tracking="--roi-tracking" in sys.argv)
     
     # Check dependencies
     if not app.check_dependencies():
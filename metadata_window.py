@@ -1,102 +1,182 @@
 import sys
+import logging
 import platform
-import wmi
-import screeninfo
-import cv2
 from datetime import datetime
 from PyQt5.QtWidgets import (QMainWindow, QWidget, QVBoxLayout, QHBoxLayout,  
                             QLineEdit, QComboBox, QPushButton, QFormLayout, QMessageBox, 
                             QSpinBox, QGroupBox, QTextEdit, QApplication)
 from PyQt5.QtCore import QThread, pyqtSignal
-from setup_window import SetupWindow
+
+# Seconds each system info probe may take before its entry is left empty;
+# opening a camera can legitimately take a few seconds
+SYSTEM_INFO_TIMEOUTS = {"laptop": 3.0, "screen": 3.0, "camera_model": 3.0, "camera": 8.0}
 
 class SystemInfoCollector:
     """Utility class to collect system information automatically."""
     
-    @staticmethod
-    def get_laptop_info():
-        """Collect laptop specifications."""
-        try:
-            w = wmi.WMI()
-            system_info = w.Win32_ComputerSystem()[0]
-            os_info = w.Win32_OperatingSystem()[0]
-            cpu_info = w.Win32_Processor()[0]
-            
-            return {
-                "manufacturer": system_info.Manufacturer,
-                "model": system_info.Model,
-                "os": f"{os_info.Caption} {os_info.OSArchitecture}",
-                "processor": cpu_info.Name,
-                "ram_gb": round(float(system_info.TotalPhysicalMemory) / (1024**3), 2),
-                "hostname": platform.node()
-            }
-        except Exception as e:
-            print(f"Error collecting laptop info: {str(e)}")
-            return {}
-
     @staticmethod
     def get_camera_info():
         """Collect webcam specifications."""
+        from frame_source import create_frame_source
+        camera_info = {}
+        source = create_frame_source()
         try:
-            camera_info = {}
-            cap = cv2.VideoCapture(0)
-            if cap.isOpened():
-                camera_info = {
-                    "resolution": f"{int(cap.get(cv2.CAP_PROP_FRAME_WIDTH))}x{int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT))}",
-                    "fps": int(cap.get(cv2.CAP_PROP_FPS))
-                }
-                cap.release()
-            
-            return camera_info
-            
-        except Exception as e:
-            print(f"Error collecting camera info: {str(e)}")
-            return {}    
+            if source.open():
+                camera_info = SystemInfoCollector.describe_camera(source.get_properties(), source.describe())
+        finally:
+            source.release()
+        return camera_info
 
     @staticmethod
-    def get_screen_info():
-        """Collect screen specifications."""
-        try:
-            monitors = screeninfo.get_monitors()
-            if not monitors:
-                return {}
-                
-            primary_monitor = next((m for m in monitors if m.is_primary), monitors[0])
-            return {
-                "resolution": f"{primary_monitor.width}x{primary_monitor.height}",
-                "size_mm": f"{primary_monitor.width_mm}x{primary_monitor.height_mm}",
-                "refresh_rate": getattr(primary_monitor, 'refresh_rate', 'Unknown'),
-                "scale_factor": getattr(primary_monitor, 'scale_factor', 1.0)
-            }
-        except Exception as e:
-            print(f"Error collecting screen info: {str(e)}")
+    def describe_camera(properties, source):
+        """Build the camera entry of the metadata from the capture properties."""
+        return {
+            "resolution": f"{properties['width']}x{properties['height']}",
+            "fps": properties['fps'],
+            "source": source
+        }
+
+    @staticmethod
+    def get_camera_model():
+        """Look up the name of the configured camera through the platform's provider."""
+        from frame_source import create_frame_source, CameraSource
+        source = create_frame_source()
+        if not isinstance(source, CameraSource):
             return {}
+        from system_info import get_system_info_provider
+        model = get_system_info_provider().get_camera_model(source.index)
+        return {"model": model} if model else {}
+
+    @staticmethod
+    def collect(probe_camera=True):
+        """
+        Run all probes in parallel, each bounded by its own timeout.
+
+        Args:
+            probe_camera: Open the camera to read its properties
+
+        Returns:
+            dict: laptop, camera and screen entries; a failed or slow probe
+                  leaves its entry empty
+        """
+        from system_info import get_system_info_provider, collect_in_parallel
+        provider = get_system_info_provider()
+        probes = {
+            "laptop": provider.get_laptop_info,
+            "screen": provider.get_screen_info,
+            "camera_model": SystemInfoCollector.get_camera_model
+        }
+        if probe_camera:
+            probes["camera"] = SystemInfoCollector.get_camera_info
+        collected = collect_in_parallel(probes, SYSTEM_INFO_TIMEOUTS)
+
+        camera_info = dict(collected.get("camera", {}), **collected["camera_model"])
+        return {
+            "laptop": collected["laptop"],
+            "camera": camera_info,
+            "screen": collected["screen"]
+        }
+
+def get_monitor_identities():
+    """Describe the connected monitors from Qt's screen list, without querying the OS."""
+    identities = []
+    for screen in QApplication.screens():
+        geometry = screen.geometry()
+        size = screen.physicalSize()
+        identities.append(f"{screen.name()} {screen.manufacturer()} {screen.model()} "
+                          f"{geometry.width()}x{geometry.height()} "
+                          f"{size.width():.0f}x{size.height():.0f}mm")
+    return identities
 
 class MetadataCollector(QThread):
     """Background thread for collecting system metadata."""
     finished = pyqtSignal(dict)
     
-    def run(self):
-        """Collect system metadata in background."""
-        system_info = {
-            "laptop": SystemInfoCollector.get_laptop_info(),
-            "camera": SystemInfoCollector.get_camera_info(),
-            "screen": SystemInfoCollector.get_screen_info()
+    def __init__(self, probe_camera=True, data_manager=None, monitors=None, parent=None):
+        """
+        Initialize the collector.
+        
+        Args:
+            probe_camera: Open the camera to read its properties; disabled when
+                          a capture session already holds the camera
+            data_manager: DataManager whose cached system profile is reused
+            monitors: Monitor identities, part of the cache key
+            parent: Parent QObject
+        """
+        super().__init__(parent)
+        self.probe_camera = probe_camera
+        self.data_manager = data_manager
+        self.monitors = monitors or []
+    
+    def get_profile_key(self):
+        """Identify the machine setup the cached profile belongs to, without slow probes."""
+        from frame_source import create_frame_source
+        return {
+            "hostname": platform.node(),
+            "camera": create_frame_source().describe(),
+            "camera_probed": self.probe_camera,
+            "monitors": self.monitors
         }
+    
+    def camera_model_changed(self, system_info):
+        """Check whether the camera model differs from the one in a cached profile."""
+        from system_info import collect_in_parallel
+        model = collect_in_parallel({"camera_model": SystemInfoCollector.get_camera_model},
+                                    SYSTEM_INFO_TIMEOUTS)["camera_model"].get("model")
+        # A failed lookup is not treated as a change
+        return model is not None and model != system_info.get("camera", {}).get("model")
+    
+    def run(self):
+        """Collect system metadata in background, reusing the cached profile when nothing changed."""
+        key = self.get_profile_key()
+        if self.data_manager is not None:
+            system_info = self.data_manager.load_system_profile(key)
+            if system_info is not None:
+                self.finished.emit(system_info)
+                # A different camera at the same index only shows in its model
+                # name, which takes a WMI query on Windows; check it afterwards
+                if not self.camera_model_changed(system_info):
+                    return
+                logging.info("Camera model changed since the system profile was cached")
+        
+        system_info = SystemInfoCollector.collect(self.probe_camera)
+        # Incomplete results are not cached so the failed probes are retried
+        if self.data_manager is not None and system_info["laptop"] and system_info["screen"]:
+            try:
+                self.data_manager.save_system_profile(key, system_info)
+            except Exception:
+                # Already logged; the profile is collected again next time
+                pass
         self.finished.emit(system_info)
 class MainWindow(QMainWindow):
     """Main window for collecting metadata and starting the experiment."""
     
-    def __init__(self, data_manager):
+    def __init__(self, data_manager, capture_session=None):
         super().__init__()
         self.data_manager = data_manager
+        self.capture_session = capture_session
         self.metadata = {}
         self.notes = []
         self.system_info = {}
+        self.camera_info = {}
         self.consent_given = False
 
-        # Start metadata collection in background
-        self.metadata_thread = MetadataCollector()
+        # Open the camera and initialize FaceMesh while the forms are filled in,
+        # so the setup window starts with a running pipeline
+        if self.capture_session is not None:
+            self.capture_session.camera_opened.connect(self.on_camera_warmed_up)
+            if self.capture_session.is_camera_open():
+                # Already running for a previous subject; camera_opened will not fire again
+                self.on_camera_warmed_up()
+            else:
+                self.capture_session.warm_up()
+
+        # Start metadata collection in background; cached for this machine setup
+        self.metadata_thread = MetadataCollector(
+            probe_camera=self.capture_session is None,
+            data_manager=self.data_manager,
+            monitors=get_monitor_identities()
+        )
         self.metadata_thread.finished.connect(self.on_metadata_collected)
         self.metadata_thread.start()       
         self.setup_ui()
@@ -112,9 +192,22 @@ class MainWindow(QMainWindow):
     def on_metadata_collected(self, system_info):
         """Handle completed metadata collection."""
         self.system_info = system_info
+        if self.camera_info:
+            self.system_info["camera"] = dict(system_info.get("camera", {}), **self.camera_info)
         self.update_system_info_preview()
         self.validate_required_fields()
 
+    def on_camera_warmed_up(self):
+        """Take the camera metadata from the pre-warmed capture session."""
+        engine = self.capture_session.engine
+        if engine is None:
+            return
+        self.camera_info = SystemInfoCollector.describe_camera(engine.camera_properties,
+                                                               engine.frame_source.describe())
+        if self.system_info:
+            self.system_info["camera"] = dict(self.system_info.get("camera", {}), **self.camera_info)
+            self.update_system_info_preview()
+
     def validate_required_fields(self):
         """Check if all required fields are filled."""
         is_valid = (
@@ -447,8 +540,9 @@ Do you consent to participate in this study?"""
             subject_dir = self.data_manager.create_subject_directory(self.metadata["subject"]["id"])
             self.data_manager.save_metadata(subject_dir, self.metadata)
                             
-            # Launch setup window
-            self.setup_window = SetupWindow(self.data_manager, subject_dir)            
+            # Launch setup window; its module is usually preloaded in the background by now
+            from setup_window import SetupWindow
+            self.setup_window = SetupWindow(self.data_manager, subject_dir, self.capture_session)            
 
             self.setup_window.show()
             self.hide()
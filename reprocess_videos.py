@@ -0,0 +1,188 @@
+import os
+import sys
+import csv
+import json
+import time
+import argparse
+from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor, as_completed
+import numpy as np
+import cv2
+import mediapipe as mp
+from landmark_store import face_mesh_landmark_count
+from landmark_formats import LANDMARK_FORMATS, LandmarkSchema, save_landmark_store
+from landmark_subsets import resolve_landmark_subset
+from frame_source import VideoFileSource
+
+# FaceMesh instance owned by each worker process
+_face_mesh = None
+
+def init_worker(settings):
+    """Create the FaceMesh instance of a worker process."""
+    global _face_mesh
+    _face_mesh = mp.solutions.face_mesh.FaceMesh(max_num_faces=1, **settings)
+
+def find_recorded_trials(roots):
+    """Find trial directories with a recorded video, frame timestamps and target timeline."""
+    for root in roots:
+        for video_file in sorted(Path(root).rglob("video.avi")):
+            trial_dir = video_file.parent
+            if (trial_dir / "video_frames.csv").exists() and (trial_dir / "target_timeline.csv").exists():
+                yield trial_dir
+
+def load_frame_timestamps(frames_file):
+    """
+    Load the capture time of every recorded video frame.
+
+    Returns:
+        tuple: (timestamps, capture_times) where capture_times holds the monotonic
+               clock readings, or NaN for recordings made before they were stored
+    """
+    with open(frames_file, newline='') as f:
+        rows = list(csv.DictReader(f))
+    timestamps = np.array([float(row["timestamp"]) for row in rows], dtype=np.float64)
+    capture_times = np.array([float(row.get("capture_time") or np.nan) for row in rows], dtype=np.float64)
+    return timestamps, capture_times
+
+def load_target_timeline(timeline_file):
+    """Load the (onset, offset, target_x, target_y) segments of a trial."""
+    with open(timeline_file, newline='') as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        rows = [[float(value) for value in row] for row in reader if row]
+    return np.array(rows, dtype=np.float64).reshape(-1, 4)
+
+def assign_targets(timestamps, timeline):
+    """
+    Look up the target shown at each frame time.
+
+    Returns:
+        tuple: (targets, shown) where shown is False for frames captured
+               while no dot was displayed
+    """
+    onsets, offsets = timeline[:, 0], timeline[:, 1]
+    segment = np.searchsorted(onsets, timestamps, side='right') - 1
+    shown = segment >= 0
+    segment = segment.clip(0)
+    if len(timeline):
+        shown &= timestamps < offsets[segment]
+        targets = timeline[segment, 2:4]
+    else:
+        shown[:] = False
+        targets = np.zeros((len(timestamps), 2))
+    return targets, shown
+
+def reprocess_trial(trial_dir, output_name, output_formats, settings):
+    """
+    Run FaceMesh over a trial's recorded video and write the trial outputs.
+
+    Args:
+        trial_dir: Trial directory containing video.avi and its timelines
+        output_name: Sub-directory of the trial to write to (empty for in place)
+        output_formats: Landmark output formats (names from LANDMARK_FORMATS)
+        settings: FaceMesh settings recorded in the output metadata
+
+    Returns:
+        dict: Processing report for the trial
+    """
+    start = time.perf_counter()
+    timestamps, capture_times = load_frame_timestamps(trial_dir / "video_frames.csv")
+    targets, shown = assign_targets(timestamps, load_target_timeline(trial_dir / "target_timeline.csv"))
+
+    metadata = {}
+    config_file = trial_dir / "setup_config.json"
+    if config_file.exists():
+        with open(config_file) as f:
+            metadata = json.load(f)
+
+    # Keep the landmark subset the trial was recorded with
+    num_landmarks = face_mesh_landmark_count(settings["refine_landmarks"])
+    schema = LandmarkSchema.get(num_landmarks,
+                                resolve_landmark_subset(metadata.get("landmark_subset"), num_landmarks))
+    store = schema.create_store()
+    # Decode as fast as possible instead of at the recorded rate
+    video = VideoFileSource(trial_dir / "video.avi", fps=0)
+    if not video.open():
+        raise IOError(f"Cannot open {video.describe()}")
+    frames_read = 0
+    try:
+        for index in range(len(timestamps)):
+            ret, frame = video.read()
+            if not ret:
+                break
+            frames_read += 1
+
+            # Frames from rest periods are skipped, as during live capture
+            if not shown[index]:
+                continue
+
+            results = _face_mesh.process(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            if results.multi_face_landmarks:
+                # Inference times of the live capture are not known offline
+                store.append(timestamps[index], targets[index, 0], targets[index, 1],
+                             results.multi_face_landmarks[0], (capture_times[index], None, None, None))
+    finally:
+        video.release()
+
+    metadata["reprocessing"] = dict(settings, source="video.avi")
+
+    output_dir = trial_dir / output_name if output_name else trial_dir
+    output_dir.mkdir(exist_ok=True)
+    # Written without a DataManager, whose logging setup targets a single session
+    save_landmark_store(output_dir, store, output_formats, schema, metadata)
+
+    return {
+        "trial": str(trial_dir),
+        "frames": frames_read,
+        "rows": len(store),
+        "seconds": time.perf_counter() - start
+    }
+
+def main():
+    """Re-run FaceMesh over recorded trial videos with configurable settings."""
+    parser = argparse.ArgumentParser(description="Regenerate landmark data from recorded trial videos.")
+    parser.add_argument("roots", nargs="+", help="Session directories or folders containing them")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Number of worker processes, each with its own FaceMesh (default: all cores)")
+    parser.add_argument("--output", default="reprocessed",
+                        help="Trial sub-directory for the outputs; empty string writes in place")
+    parser.add_argument("--formats", nargs="+", default=["csv", "npz"], choices=sorted(LANDMARK_FORMATS),
+                        help="Landmark output formats")
+    parser.add_argument("--no-refine", action="store_true", help="Disable iris landmark refinement")
+    parser.add_argument("--min-detection-confidence", type=float, default=0.5)
+    parser.add_argument("--min-tracking-confidence", type=float, default=0.5)
+    args = parser.parse_args()
+
+    settings = {
+        "refine_landmarks": not args.no_refine,
+        "min_detection_confidence": args.min_detection_confidence,
+        "min_tracking_confidence": args.min_tracking_confidence
+    }
+
+    trial_dirs = list(find_recorded_trials(args.roots))
+    print(f"Found {len(trial_dirs)} recorded trials")
+
+    failures = 0
+    with ProcessPoolExecutor(max_workers=args.workers, initializer=init_worker,
+                             initargs=(settings,)) as executor:
+        futures = {
+            executor.submit(reprocess_trial, trial_dir, args.output, args.formats, settings): trial_dir
+            for trial_dir in trial_dirs
+        }
+        for future in as_completed(futures):
+            try:
+                report = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"FAILED {futures[future]}: {str(e)}")
+                continue
+
+            seconds = max(report["seconds"], 1e-9)
+            print(f"{report['trial']}: {report['frames']} frames, {report['rows']} rows in "
+                  f"{seconds:.1f} s ({report['frames'] / seconds:.1f} fps)")
+
+    print(f"Processed {len(trial_dirs) - failures} trials, {failures} failed")
+    return 1 if failures else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,41 +3,45 @@ from datetime import datetime
 from PyQt5.QtWidgets import (QWidget, QVBoxLayout, QHBoxLayout, QLabel, 
                             QPushButton, QComboBox, QFormLayout, QMessageBox,
                             QGroupBox, QApplication, QDoubleSpinBox)
-from PyQt5.QtCore import Qt, QTimer
 from PyQt5.QtGui import QPixmap, QImage
 import cv2
+from capture_session import CaptureSession
+from frame_source import clock
+from landmark_subsets import LANDMARK_SUBSETS, EYE_CORNERS, IRISES
 from experiment_window import ExperimentWindow
 import mediapipe as mp
 import numpy as np
 
+# Maximum redraw rate of the camera preview, independent of the inference rate
+PREVIEW_FPS = 15
+
 class SetupWindow(QWidget):
     """Window for experiment setup including camera angles and distances."""
 
-    def __init__(self, data_manager, subject_dir, parent=None):
+    def __init__(self, data_manager, subject_dir, capture_session=None, parent=None):
         super().__init__(parent)
         self.data_manager = data_manager
         self.subject_dir = subject_dir
-        self.camera = None
+        # Camera session shared with the other windows, or a private one
+        self.owns_capture_session = capture_session is None
+        self.capture_session = capture_session if capture_session is not None else CaptureSession()
+        self.capture_engine = None
+        self.last_result = None
+        self.last_preview_time = 0.0
         self.anonymized = True
         
-        # Initialize MediaPipe components
+        # Initialize MediaPipe drawing components
         self.mp_face_mesh = mp.solutions.face_mesh
         self.mp_drawing = mp.solutions.drawing_utils
         self.mp_drawing_styles = mp.solutions.drawing_styles
-        self.face_mesh = self.mp_face_mesh.FaceMesh(
-            max_num_faces=1,
-            refine_landmarks=True,
-            min_detection_confidence=0.5,
-            min_tracking_confidence=0.5
-        )
         
         # Define experimental parameters first
         self.yaw_angles = [0, 15, -15, 30, -30]
         self.pitch_angles = [90, 100, 110, 120]
         self.distances = [60, 90]  # cm
 
-        # Add trial tracking
-        self.completed_setups = set()  # Track which angle/distance combinations have been done
+        # Add trial tracking, restored from the session index after a restart
+        self.completed_setups = self.data_manager.get_completed_setups(self.subject_dir)
         self.total_combinations = len(self.yaw_angles) * len(self.pitch_angles) * len(self.distances)
         
         # Now setup UI and camera
@@ -108,6 +112,11 @@ class SetupWindow(QWidget):
         self.distance_combo.addItems([f"{dist} cm" for dist in self.distances])
         setup_form.addRow("Subject Distance:", self.distance_combo)
         
+        # Landmarks written for the trial
+        self.landmark_subset_combo = QComboBox()
+        self.landmark_subset_combo.addItems(list(LANDMARK_SUBSETS))
+        setup_form.addRow("Landmarks:", self.landmark_subset_combo)
+        
         setup_group.setLayout(setup_form)
         controls_layout.addWidget(setup_group)
 
@@ -217,112 +226,108 @@ class SetupWindow(QWidget):
         return self.get_current_combination() in self.completed_setups
     
     def setup_camera(self):
-        """Initialize the camera preview."""
-        if self.camera is not None:
-            self.camera.release()  # Release existing camera if any
+        """Subscribe to the capture session for the camera preview."""
+        # Frames are mirrored before inference and kept for the preview
+        self.capture_engine = self.capture_session.subscribe(
+            self.update_preview,
+            on_failed=self.on_camera_failed,
+            flip=True,
+            keep_frames=True,
+            state="preview"
+        )
 
-        self.camera = cv2.VideoCapture(0)
-        if not self.camera.isOpened():
-            QMessageBox.critical(self, "Error", "Failed to open camera!")
-            return
-        
-        # Start timer for camera preview updates
-        if hasattr(self, 'timer'):
-            self.timer.stop()  # Stop existing timer if any
+    def stop_camera(self):
+        """Stop the preview; the camera stays open in the shared session."""
+        if self.capture_engine is not None:
+            self.capture_session.unsubscribe(self.update_preview)
+            self.capture_engine = None
+        self.last_result = None
 
-        # Start timer for camera preview updates
-        self.timer = QTimer()
-        self.timer.timeout.connect(self.update_preview)
-        self.timer.start(30)  # Update every 30ms (approx. 33 fps)
+    def on_camera_failed(self, message):
+        """Report a camera failure from the capture engine."""
+        QMessageBox.critical(self, "Error", message)
     
     def update_preview(self):
         """Update the camera preview with facial landmarks."""
-        if self.camera is None:
+        if self.capture_engine is None:
+            return
+            
+        # Only the newest result is rendered; older ones are stale
+        result = self.capture_engine.get_latest_result()
+        if result is None:
             return
+        self.last_result = result
+        
+        # Inference keeps its own rate; the preview is redrawn at most PREVIEW_FPS times a second
+        now = clock()
+        if now - self.last_preview_time < 1 / PREVIEW_FPS or not self.preview_label.isVisible():
+            return
+        self.last_preview_time = now
+        
+        # Downsample once to the label size and draw on that buffer
+        frame = result.frame
+        frame_h, frame_w = frame.shape[:2]
+        scale = min(self.preview_label.width() / frame_w, self.preview_label.height() / frame_h)
+        size = (max(int(frame_w * scale), 1), max(int(frame_h * scale), 1))
+        if self.anonymized and result.landmarks is not None:
+            annotated_frame = np.zeros((size[1], size[0], 3), dtype=np.uint8)
+        else:
+            annotated_frame = cv2.resize(frame, size, interpolation=cv2.INTER_AREA)
+        h, w = annotated_frame.shape[:2]
+        
+        # Draw the landmarks on the frame
+        if result.landmarks is not None:
+            face_landmarks = result.landmarks
             
-        ret, frame = self.camera.read()
-        if ret:
-            # Flip the frame horizontally for a mirror effect
-            frame = cv2.flip(frame, 1)
+            # Draw face mesh
+            self.mp_drawing.draw_landmarks(
+                image=annotated_frame,
+                landmark_list=face_landmarks,
+                connections=self.mp_face_mesh.FACEMESH_TESSELATION,
+                landmark_drawing_spec=None,
+                connection_drawing_spec=self.mp_drawing_styles.get_default_face_mesh_tesselation_style()
+            )
+            
+            # Draw the contours
+            self.mp_drawing.draw_landmarks(
+                image=annotated_frame,
+                landmark_list=face_landmarks,
+                connections=self.mp_face_mesh.FACEMESH_CONTOURS,
+                landmark_drawing_spec=None,
+                connection_drawing_spec=self.mp_drawing_styles.get_default_face_mesh_contours_style()
+            )
             
-            # Convert the BGR image to RGB
-            rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            # Draw iris landmarks
+            self.mp_drawing.draw_landmarks(
+                image=annotated_frame,
+                landmark_list=face_landmarks,
+                connections=self.mp_face_mesh.FACEMESH_IRISES,
+                landmark_drawing_spec=None,
+                connection_drawing_spec=self.mp_drawing_styles.get_default_face_mesh_iris_connections_style()
+            )
             
-            # Process the frame and detect landmarks
-            results = self.face_mesh.process(rgb_frame)
+            # Draw specific points for eye landmarks
+            for idx in EYE_CORNERS:
+                pos = face_landmarks.landmark[idx]
+                cv2.circle(annotated_frame, (int(pos.x * w), int(pos.y * h)), 3, (0, 255, 0), -1)
             
-            # Draw the landmarks on the frame
-            if results.multi_face_landmarks:
-                face_landmarks = results.multi_face_landmarks[0]
-                
-                # Create a copy of the frame for drawing
-                annotated_frame = np.zeros_like(frame) if self.anonymized else frame.copy()
-                
-                # Draw face mesh
-                self.mp_drawing.draw_landmarks(
-                    image=annotated_frame,
-                    landmark_list=face_landmarks,
-                    connections=self.mp_face_mesh.FACEMESH_TESSELATION,
-                    landmark_drawing_spec=None,
-                    connection_drawing_spec=self.mp_drawing_styles.get_default_face_mesh_tesselation_style()
-                )
-                
-                # Draw the contours
-                self.mp_drawing.draw_landmarks(
-                    image=annotated_frame,
-                    landmark_list=face_landmarks,
-                    connections=self.mp_face_mesh.FACEMESH_CONTOURS,
-                    landmark_drawing_spec=None,
-                    connection_drawing_spec=self.mp_drawing_styles.get_default_face_mesh_contours_style()
-                )
-                
-                # Draw iris landmarks
-                self.mp_drawing.draw_landmarks(
-                    image=annotated_frame,
-                    landmark_list=face_landmarks,
-                    connections=self.mp_face_mesh.FACEMESH_IRISES,
-                    landmark_drawing_spec=None,
-                    connection_drawing_spec=self.mp_drawing_styles.get_default_face_mesh_iris_connections_style()
-                )
-                
-                # Draw specific points for eye landmarks
-                for idx in [33, 133, 362, 263]:  # Corner points of the eyes
+            # Draw iris centers and boundaries
+            for idx in IRISES:
+                if idx < len(face_landmarks.landmark):
                     pos = face_landmarks.landmark[idx]
-                    x = int(pos.x * frame.shape[1])
-                    y = int(pos.y * frame.shape[0])
-                    cv2.circle(annotated_frame, (x, y), 3, (0, 255, 0), -1)
-                
-                # Draw iris centers
-                iris_landmarks = [
-                    (468, 473),  # Left eye
-                    (473, 477)   # Right eye
-                ]
-                for start, end in iris_landmarks:
-                    for idx in range(start, end + 1):
-                        if idx < len(face_landmarks.landmark):
-                            pos = face_landmarks.landmark[idx]
-                            x = int(pos.x * frame.shape[1])
-                            y = int(pos.y * frame.shape[0])
-                            cv2.circle(annotated_frame, (x, y), 3, (255, 0, 0), -1)
-                
-                # Add text to show that landmarks are detected
-                cv2.putText(annotated_frame, "Face Detected", (10, 30),
-                           cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
-            else:
-                # If no face is detected, show the original frame with a warning
-                annotated_frame = frame
-                cv2.putText(annotated_frame, "No Face Detected", (10, 30),
-                           cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+                    cv2.circle(annotated_frame, (int(pos.x * w), int(pos.y * h)), 3, (255, 0, 0), -1)
             
-            # Convert the frame to QPixmap and display it
-            h, w, ch = annotated_frame.shape
-            bytes_per_line = ch * w
-            qt_image = QImage(cv2.cvtColor(annotated_frame, cv2.COLOR_BGR2RGB).data,
-                            w, h, bytes_per_line, QImage.Format_RGB888)
-            pixmap = QPixmap.fromImage(qt_image)
-            scaled_pixmap = pixmap.scaled(self.preview_label.size(), 
-                                        Qt.KeepAspectRatio)
-            self.preview_label.setPixmap(scaled_pixmap)
+            # Add text to show that landmarks are detected
+            cv2.putText(annotated_frame, "Face Detected", (10, 30),
+                       cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 255, 0), 2)
+        else:
+            # If no face is detected, show the original frame with a warning
+            cv2.putText(annotated_frame, "No Face Detected", (10, 30),
+                       cv2.FONT_HERSHEY_SIMPLEX, 1, (0, 0, 255), 2)
+        
+        # Wrap the BGR buffer directly; QPixmap.fromImage makes the only copy
+        qt_image = QImage(annotated_frame.data, w, h, annotated_frame.strides[0], QImage.Format_BGR888)
+        self.preview_label.setPixmap(QPixmap.fromImage(qt_image))
 
     def validate_setup(self):
         """Validate the experimental setup."""
@@ -332,12 +337,11 @@ class SetupWindow(QWidget):
                 raise Exception("This combination has already been completed. Please select a different combination.")
                         
             # Check camera feed
-            if self.camera is None or not self.camera.isOpened():
+            if self.capture_engine is None or not self.capture_engine.isRunning():
                 raise Exception("Camera is not properly initialized")
             
             # Check if face is detected
-            ret, frame = self.camera.read()
-            if not ret:
+            if self.last_result is None:
                 raise Exception("Cannot read from camera")
             
             # Process the frame with MediaPipe
@@ -366,64 +370,6 @@ class SetupWindow(QWidget):
             self.start_btn.setEnabled(False)
             QMessageBox.warning(self, "Validation Failed", str(e))    
         
-    def start_trial(self):
-        """Start a new trial with current setup."""
-        if not self.start_btn.isEnabled():
-            return
-            
-        try:
-            # Create new trial directory
-            trial_dir = self.data_manager.create_trial_directory(self.subject_dir)
-
-            # Clean up camera resources before starting experiment
-            if self.camera is not None:
-                self.camera.release()
-            if hasattr(self, 'timer'):
-                self.timer.stop()            
-
-            # Get selected pitch and apply offset correction
-            selected_pitch = self.pitch_angles[self.pitch_combo.currentIndex()]
-            # corrected_pitch = selected_pitch - self.pitch_offset  # Subtract offset to get true pitch
-            
-            # Prepare trial configuration
-            trial_config = {
-                "trial_id": trial_dir.name,
-                "timestamp": datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-                "setup": {
-                    "yaw": self.yaw_angles[self.yaw_combo.currentIndex()],
-                    "pitch": selected_pitch,  # Store selected pitch
-                    # "corrected_pitch": corrected_pitch,  # Store corrected pitch
-                    # "pitch_offset": self.pitch_offset,  # Store offset for reference
-                    "distance": self.distances[self.distance_combo.currentIndex()]
-                },
-                "conditions": {
-                    "dot_display_time": 2000,
-                    "rest_time": 1000,
-                    "grid_size": 3,
-                    "dot_radius": 15
-                }
-            }
-            
-            # Save trial configuration
-            self.data_manager.save_trial_config(trial_dir, trial_config)
-            
-            # Launch experiment window
-            self.experiment_window = ExperimentWindow(
-                self.data_manager,
-                trial_dir,
-                trial_config
-            )
-
-            # Connect the finished signal
-            self.experiment_window.finished.connect(self.on_experiment_finished)
-            self.experiment_window.show()
-            self.hide()  # Hide setup window but don't close it
-            
-            
-        except Exception as e:
-            QMessageBox.critical(self, "Error", 
-                               f"Failed to start trial: {str(e)}")    
-        
     def on_experiment_finished(self):
         """Handle completion of an experiment trial."""
         # Add current combination to completed setups
@@ -437,7 +383,7 @@ class SetupWindow(QWidget):
         self.validation_label.setStyleSheet("color: black")
         self.start_btn.setEnabled(False)
         
-        # Show window and reinitialize camera
+        # Show window and resume the preview on the still running camera
         self.show()
         self.setup_camera()
         
@@ -474,7 +420,7 @@ class SetupWindow(QWidget):
     def start_new_subject(self):
         """Start a session with a new subject."""
         from metadata_window import MainWindow
-        self.metadata_window = MainWindow(self.data_manager)
+        self.metadata_window = MainWindow(self.data_manager, self.capture_session)
         self.metadata_window.show()
         self.close()
     
@@ -490,12 +436,9 @@ class SetupWindow(QWidget):
 
     def closeEvent(self, event):
         """Clean up resources when window is closed."""
-        if self.camera is not None:
-            self.camera.release()
-        if hasattr(self, 'timer'):
-            self.timer.stop()
-        if hasattr(self, 'face_mesh'):
-            self.face_mesh.close()
+        self.stop_camera()
+        if self.owns_capture_session:
+            self.capture_session.stop()
         event.accept()
 
     def start_trial(self):
@@ -521,17 +464,24 @@ class SetupWindow(QWidget):
                     "rest_time": 1000,
                     "grid_size": 3,
                     "dot_radius": 15
-                }
+                },
+                "capture": {
+                    "roi_tracking": self.capture_session.roi_tracking
+                },
+                "landmark_subset": self.landmark_subset_combo.currentText()
             }
             
             # Save trial configuration
             self.data_manager.save_trial_config(trial_dir, trial_config)
+            self.data_manager.record_trial(trial_dir, trial_config['setup'], "started")
             
-            # Launch experiment window
+            # Hand the running camera over to the experiment window
+            self.stop_camera()
             self.experiment_window = ExperimentWindow(
                 self.data_manager,
                 trial_dir,
-                trial_config
+                trial_config,
+                self.capture_session
             )
             # Connect the finished signal
             self.experiment_window.finished.connect(self.on_experiment_finished)
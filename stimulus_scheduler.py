@@ -0,0 +1,104 @@
+import math
+from PyQt5.QtCore import QObject, QTimer, Qt
+from frame_source import clock
+
+def build_trial_schedule(conditions, num_points):
+    """
+    Precompute the dot onsets and offsets of a trial.
+
+    Every dot is shown for dot_display_time and followed by rest_time; the
+    final entry ends the trial after the last rest period.
+
+    Args:
+        conditions: trial_config['conditions'] with dot_display_time and rest_time in ms
+        num_points: Number of dots shown in the trial
+
+    Returns:
+        list: (offset in seconds from the trial start, action) tuples where
+              action is "dot_onset", "dot_offset" or "trial_end"
+    """
+    display = conditions['dot_display_time'] / 1000
+    period = display + conditions['rest_time'] / 1000
+    schedule = []
+    for k in range(num_points):
+        schedule.append((k * period, "dot_onset"))
+        schedule.append((k * period + display, "dot_offset"))
+    schedule.append((num_points * period, "trial_end"))
+    return schedule
+
+class StimulusScheduler(QObject):
+    """Runs callbacks at absolute deadlines on the capture clock, so lateness never accumulates."""
+
+    def __init__(self, parent=None):
+        """
+        Initialize the scheduler.
+
+        Args:
+            parent: Parent QObject
+        """
+        super().__init__(parent)
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setTimerType(Qt.PreciseTimer)
+        self._timer.timeout.connect(self._on_timeout)
+        self._steps = []
+        self._next_step = 0
+        self.deviations = []
+
+    def start(self, steps, start_time=None):
+        """
+        Start running a schedule.
+
+        Args:
+            steps: List of (offset in seconds, callback) tuples; each callback
+                   receives its deadline as a clock() reading
+            start_time: clock() reading the offsets are relative to (default: now)
+        """
+        if start_time is None:
+            start_time = clock()
+        self._steps = sorted(((start_time + offset, callback) for offset, callback in steps),
+                             key=lambda step: step[0])
+        self._next_step = 0
+        self.deviations = []
+        self._arm()
+
+    def _arm(self):
+        """Set the timer for the next deadline."""
+        if self._next_step >= len(self._steps):
+            return
+        deadline = self._steps[self._next_step][0]
+        delay_ms = math.ceil((deadline - clock()) * 1000)
+        self._timer.start(max(delay_ms, 0))
+
+    def _on_timeout(self):
+        """Run the due step, or re-arm if the timer fired before its deadline."""
+        deadline, callback = self._steps[self._next_step]
+        now = clock()
+        if now < deadline:
+            self._arm()
+            return
+
+        self._next_step += 1
+        self.deviations.append(now - deadline)
+        callback(deadline)
+        # The next delay is measured from the absolute deadline, absorbing this step's lateness
+        self._arm()
+
+    def is_active(self):
+        """Check if steps remain to be run."""
+        return self._next_step < len(self._steps)
+
+    def stop(self):
+        """Cancel the remaining steps."""
+        self._timer.stop()
+        self._next_step = len(self._steps)
+
+    def get_report(self):
+        """Return the mean and maximum lateness in ms of the steps run so far."""
+        if not self.deviations:
+            return {"steps": 0, "mean_ms": 0.0, "max_ms": 0.0}
+        return {
+            "steps": len(self.deviations),
+            "mean_ms": sum(self.deviations) / len(self.deviations) * 1000,
+            "max_ms": max(self.deviations) * 1000
+        }
@@ -0,0 +1,208 @@
+import sys
+import time
+import logging
+import platform
+import threading
+from pathlib import Path
+
+def read_text(path, default=None):
+    """Read a small text file such as a /proc or /sys entry, stripped of whitespace."""
+    try:
+        return Path(path).read_text().strip()
+    except OSError:
+        return default
+
+def parse_edid(edid):
+    """
+    Extract the monitor identity, physical size and refresh rate from an EDID block.
+
+    Returns:
+        dict: manufacturer, product_code, size_mm and refresh_rate where available
+    """
+    if len(edid) < 128 or edid[:8] != b'\x00\xff\xff\xff\xff\xff\xff\x00':
+        return {}
+
+    # Three 5-bit letters packed into two big-endian bytes
+    code = (edid[8] << 8) | edid[9]
+    manufacturer = "".join(chr(((code >> shift) & 0x1f) + 64) for shift in (10, 5, 0))
+    info = {
+        "manufacturer": manufacturer,
+        "product_code": edid[10] | (edid[11] << 8)
+    }
+    if edid[21] and edid[22]:
+        info["size_mm"] = f"{edid[21] * 10}x{edid[22] * 10}"
+
+    # First detailed timing descriptor holds the preferred mode
+    pixel_clock = (edid[54] | (edid[55] << 8)) * 10000
+    if pixel_clock:
+        h_total = edid[56] + ((edid[58] & 0xf0) << 4) + edid[57] + ((edid[58] & 0x0f) << 8)
+        v_total = edid[59] + ((edid[61] & 0xf0) << 4) + edid[60] + ((edid[61] & 0x0f) << 8)
+        if h_total and v_total:
+            info["refresh_rate"] = round(pixel_clock / (h_total * v_total), 2)
+    return info
+
+class SystemInfoProvider:
+    """Portable provider built on the platform module and screeninfo."""
+
+    def get_laptop_info(self):
+        """Collect the machine's manufacturer, model, OS, processor and memory."""
+        return {
+            "manufacturer": "Unknown",
+            "model": "Unknown",
+            "os": f"{platform.system()} {platform.release()} {platform.machine()}",
+            "processor": platform.processor() or platform.machine(),
+            "ram_gb": None,
+            "hostname": platform.node()
+        }
+
+    def get_camera_model(self, index=0):
+        """Return the name of the camera with the given index, if it can be found."""
+        return None
+
+    def get_screen_info(self):
+        """Collect the primary monitor's resolution, size and refresh rate."""
+        import screeninfo
+        monitors = screeninfo.get_monitors()
+        if not monitors:
+            return {}
+
+        primary_monitor = next((m for m in monitors if m.is_primary), monitors[0])
+        return {
+            "resolution": f"{primary_monitor.width}x{primary_monitor.height}",
+            "size_mm": f"{primary_monitor.width_mm}x{primary_monitor.height_mm}",
+            "refresh_rate": getattr(primary_monitor, 'refresh_rate', 'Unknown'),
+            "scale_factor": getattr(primary_monitor, 'scale_factor', 1.0)
+        }
+
+class WindowsSystemInfoProvider(SystemInfoProvider):
+    """Windows provider querying WMI."""
+
+    def _query(self, function):
+        """Run function(wmi_connection) with COM initialized for the calling thread."""
+        import pythoncom
+        import wmi
+        pythoncom.CoInitialize()
+        try:
+            return function(wmi.WMI())
+        finally:
+            pythoncom.CoUninitialize()
+
+    def get_laptop_info(self):
+        def query(w):
+            system_info = w.Win32_ComputerSystem()[0]
+            os_info = w.Win32_OperatingSystem()[0]
+            cpu_info = w.Win32_Processor()[0]
+            return {
+                "manufacturer": system_info.Manufacturer,
+                "model": system_info.Model,
+                "os": f"{os_info.Caption} {os_info.OSArchitecture}",
+                "processor": cpu_info.Name,
+                "ram_gb": round(float(system_info.TotalPhysicalMemory) / (1024**3), 2),
+                "hostname": platform.node()
+            }
+        return self._query(query)
+
+    def get_camera_model(self, index=0):
+        def query(w):
+            cameras = w.query("SELECT Name FROM Win32_PnPEntity "
+                              "WHERE PNPClass = 'Camera' OR PNPClass = 'Image'")
+            return cameras[index].Name if index < len(cameras) else None
+        return self._query(query)
+
+class LinuxSystemInfoProvider(SystemInfoProvider):
+    """Linux provider reading /proc and /sys; needs no extra packages."""
+
+    def get_laptop_info(self):
+        info = super().get_laptop_info()
+
+        dmi = Path("/sys/class/dmi/id")
+        info["manufacturer"] = read_text(dmi / "sys_vendor", "Unknown")
+        info["model"] = read_text(dmi / "product_name", "Unknown")
+
+        os_release = read_text("/etc/os-release", "")
+        for line in os_release.splitlines():
+            if line.startswith("PRETTY_NAME="):
+                info["os"] = f"{line.split('=', 1)[1].strip(chr(34))} {platform.machine()}"
+
+        for line in read_text("/proc/cpuinfo", "").splitlines():
+            if line.startswith("model name"):
+                info["processor"] = line.split(":", 1)[1].strip()
+                break
+
+        for line in read_text("/proc/meminfo", "").splitlines():
+            if line.startswith("MemTotal:"):
+                info["ram_gb"] = round(int(line.split()[1]) / (1024**2), 2)
+                break
+        return info
+
+    def get_camera_model(self, index=0):
+        return read_text(f"/sys/class/video4linux/video{index}/name")
+
+    def get_screen_info(self):
+        # screeninfo needs a running X server; DRM connectors work everywhere
+        for connector in sorted(Path("/sys/class/drm").glob("card*-*")):
+            if read_text(connector / "status") != "connected":
+                continue
+            modes = read_text(connector / "modes", "").splitlines()
+            try:
+                edid = (connector / "edid").read_bytes()
+            except OSError:
+                edid = b""
+
+            info = {
+                "connector": connector.name.split("-", 1)[1],
+                "resolution": modes[0] if modes else "Unknown",
+                "size_mm": "Unknown",
+                "refresh_rate": "Unknown",
+                "scale_factor": 1.0
+            }
+            info.update(parse_edid(edid))
+            return info
+        return super().get_screen_info()
+
+def get_system_info_provider():
+    """Return the system info provider for the running platform."""
+    if sys.platform == "win32":
+        return WindowsSystemInfoProvider()
+    if sys.platform.startswith("linux"):
+        return LinuxSystemInfoProvider()
+    return SystemInfoProvider()
+
+def collect_in_parallel(probes, timeouts=None, default_timeout=5.0):
+    """
+    Run independent probes on daemon threads and wait a bounded time for each.
+
+    A probe that fails or does not finish within its timeout yields an empty
+    dict; a hung probe keeps running in the background but is never waited for.
+
+    Args:
+        probes: Dictionary of name -> function returning a dict
+        timeouts: Optional dictionary of name -> timeout in seconds
+        default_timeout: Timeout of probes without an entry in timeouts
+
+    Returns:
+        dict: name -> probe result
+    """
+    timeouts = timeouts or {}
+    results = {}
+
+    def run_probe(name, probe):
+        try:
+            results[name] = probe()
+        except Exception as e:
+            logging.error(f"Error collecting {name} info: {str(e)}")
+
+    start = time.monotonic()
+    threads = {}
+    for name, probe in probes.items():
+        threads[name] = threading.Thread(target=run_probe, args=(name, probe), daemon=True)
+        threads[name].start()
+
+    collected = {}
+    for name, thread in threads.items():
+        deadline = start + timeouts.get(name, default_timeout)
+        thread.join(max(deadline - time.monotonic(), 0))
+        if thread.is_alive():
+            logging.warning(f"Collecting {name} info timed out")
+        collected[name] = results.get(name) or {}
+    return collected